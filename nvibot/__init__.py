@@ -1,4 +1,4 @@
-# coding=utf-8
-
-__title__ = "nvibot"
-__version__ = "1.0.0"
+# coding=utf-8
+
+__title__ = "nvibot"
+__version__ = "1.0.0"
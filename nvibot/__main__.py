@@ -1,77 +1,140 @@
-# coding=utf-8
-
-import sys
-import argparse
-import logging
-
-from . import __title__
-from .notifiers import PushoverNotifier, DiscordNotifier
-from .nvibot import Nvibot
-from .ldlc_driver import LdlcDriver
-from .nvidia_api import NvidiaApiScrapper
-from . import secrets
-
-logger = logging.getLogger(__title__)
-
-
-def run_nvibot():
-    gpu_choices = NvidiaApiScrapper.sku_name_map.values()
-    parser = argparse.ArgumentParser(__title__)
-    parser.add_argument("buyer")
-    parser.add_argument("buy_priority", nargs="+", choices=gpu_choices)
-    parser.add_argument("--buy-limit", type=int, default=1)
-    parser.add_argument("--timeout", type=int, default=2)
-    parser.add_argument(
-        "--notifier", choices=["discord", "pushover"], default="discord"
-    )
-
-    args = parser.parse_args()
-
-    # Logging initialisation
-    logging.basicConfig(
-        stream=sys.stderr, format="%(asctime)s - %(levelname)s: %(message)s"
-    )
-    logger.setLevel(logging.DEBUG)
-
-    # Brobot components initialisation
-    secret_manager = secrets.get_manager(args.buyer)
-    if args.notifier == "discord":
-        notifier = DiscordNotifier(secret_manager)
-    else:
-        notifier = PushoverNotifier(secret_manager)
-
-    notifier.push(f"{__title__} initializing")
-
-    ldlc_driver = LdlcDriver(notifier, secret_manager, args.timeout)
-    nvidia_scrapper = NvidiaApiScrapper(notifier, args.timeout)
-    bot = Nvibot(
-        ldlc_driver, nvidia_scrapper, notifier, args.buy_priority, args.buy_limit
-    )
-
-    # Run the brobot
-    try:
-        bot.run()
-    except Exception as exc:
-        notifier.push(f"{__title__} exited with error: {exc}")
-        raise
-
-
-def test_ldlc_driver():
-
-    logging.basicConfig(
-        stream=sys.stderr, format="%(asctime)s - %(levelname)s: %(message)s"
-    )
-    logger.setLevel(logging.DEBUG)
-
-    buyer = sys.argv[1]
-    product_url = sys.argv[2]
-
-    secret_manager = secrets.get_manager(buyer)
-    notifier = DiscordNotifier(secret_manager)
-    with LdlcDriver(notifier, secret_manager) as ldlc:
-        ldlc.login()
-        ldlc.buy(product_url)
-
-
-if __name__ == "__main__":
-    run_nvibot()
+# coding=utf-8
+
+import sys
+import argparse
+import logging
+
+from . import __title__
+from .notifiers import DiscordNotifier
+from .scheduler import AdaptiveScheduler
+from . import secrets
+from . import cli
+
+logger = logging.getLogger(__title__)
+
+
+def run_nvibot():
+    parser = argparse.ArgumentParser(__title__)
+    parser.add_argument("buyer")
+    parser.add_argument("buy_priority", nargs="+")
+    parser.add_argument("--buy-limit", type=int, default=1)
+    cli.add_common_arguments(parser)
+    cli.add_checkout_arguments(parser)
+    parser.add_argument("--pool-size", type=int, default=0)
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument(
+        "--max-browser-rss",
+        type=float,
+        help="recycle browsers whose process tree grows past this RSS, in MiB",
+    )
+    parser.add_argument(
+        "--max-browser-latency",
+        type=float,
+        help="recycle browsers slower to answer than this, in seconds",
+    )
+    parser.add_argument(
+        "--max-browser-age", type=float, help="recycle browsers older, in hours"
+    )
+    parser.add_argument("--cookie-file", help="persist the LDLC session there")
+
+    args = parser.parse_args()
+
+    # Selenium takes a while to load, do not import it to parse the arguments
+    from .nvibot import Nvibot
+    from .ldlc_driver import LdlcDriver
+    from .driver_pool import LdlcDriverPool
+    from .browser import BrowserProfile
+    from .browser_watchdog import BrowserWatchdog
+
+    cli.check_gpus(parser, args, args.buy_priority)
+    if args.parallel > 1 and args.pool_size < args.parallel:
+        parser.error("--parallel requires a --pool-size at least as large")
+
+    cli.setup(args)
+
+    # Brobot components initialisation
+    secret_manager = secrets.get_manager(args.buyer, args.secrets)
+    notifier = cli.build_notifier(args, secret_manager)
+    notifier.push(f"{__title__} initializing")
+    nvidia_scrapper = cli.build_scrapper(args, notifier)
+
+    profile = BrowserProfile.full() if args.full_browser else BrowserProfile()
+
+    def new_ldlc_driver():
+        return LdlcDriver(
+            notifier,
+            secret_manager,
+            args.timeout,
+            profile=profile,
+            cookie_path=args.cookie_file,
+            http_checkout=args.http_checkout,
+            transaction_budget=args.transaction_budget,
+        )
+
+    watchdog = None
+    if any(
+        limit is not None
+        for limit in (
+            args.max_browser_rss,
+            args.max_browser_latency,
+            args.max_browser_age,
+        )
+    ):
+        watchdog = BrowserWatchdog(
+            args.max_browser_rss,
+            args.max_browser_latency,
+            None if args.max_browser_age is None else args.max_browser_age * 3600,
+        )
+
+    # Recycling needs a pool, a single driver is replaced by a pool of one
+    if args.pool_size > 0 or watchdog is not None:
+        ldlc_driver = LdlcDriverPool(
+            new_ldlc_driver, max(args.pool_size, 1), watchdog=watchdog
+        )
+    else:
+        ldlc_driver = new_ldlc_driver()
+    scheduler = AdaptiveScheduler(args.period)
+    bot = Nvibot(
+        ldlc_driver,
+        nvidia_scrapper,
+        notifier,
+        args.buy_priority,
+        args.buy_limit,
+        scheduler,
+        args.parallel,
+    )
+
+    # Run the brobot
+    try:
+        bot.run()
+    except Exception as exc:
+        notifier.push(f"{__title__} exited with error: {exc}")
+        raise
+    finally:
+        notifier.close()
+
+
+def test_ldlc_driver():
+
+    logging.basicConfig(
+        stream=sys.stderr, format="%(asctime)s - %(levelname)s: %(message)s"
+    )
+    logger.setLevel(logging.DEBUG)
+
+    buyer = sys.argv[1]
+    product_url = sys.argv[2]
+
+    from .ldlc_driver import LdlcDriver
+
+    secret_manager = secrets.get_manager(buyer)
+    notifier = DiscordNotifier(secret_manager)
+    try:
+        with LdlcDriver(notifier, secret_manager) as ldlc:
+            ldlc.ensure_logged_in()
+            ldlc.buy(product_url)
+    finally:
+        notifier.close()
+
+
+if __name__ == "__main__":
+    run_nvibot()
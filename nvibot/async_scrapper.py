@@ -0,0 +1,187 @@
+# coding=utf-8
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Callable
+
+from . import __title__
+from .nvidia_api import NvidiaApiScrapper, NvidiaApiError
+from .scheduler import PollScheduler, AdaptiveScheduler
+
+logger = logging.getLogger(__title__)
+
+
+class AsyncNvidiaScrapper:
+    """Poll several Nvidia API scrappers (e.g. one per locale or SKU group)
+    concurrently, each on its own scheduler, from an asyncio loop running in a
+    background thread. Blocking HTTP polls are offloaded to a thread pool so a
+    slow market never delays the others.
+
+    Each scheduler backs off on the errors of its own scrapper, and a "new_url"
+    event from any scrapper starts a burst on all of them.
+
+    It exposes the same ``scrap`` method as ``NvidiaApiScrapper``: it returns
+    the merged URLs found by every scrapper since the previous call.
+
+    :param scrappers: the scrappers to poll
+    :param periods: poll period of each scrapper, in seconds. Defaults to
+        ``period`` for every scrapper
+    :param period: default poll period, in seconds
+    :param schedulers: scheduler of each scrapper. Defaults to an
+        ``AdaptiveScheduler`` on the scrapper period
+
+    Example:
+
+        >>> scrapper = AsyncNvidiaScrapper([
+                NvidiaApiScrapper.for_locale(notifier, 2, "FR"),
+                NvidiaApiScrapper.for_locale(notifier, 2, "DE"),
+            ])
+            urls_to_try = scrapper.scrap()
+    """
+
+    def __init__(
+        self,
+        scrappers: List[NvidiaApiScrapper],
+        periods: Optional[List[float]] = None,
+        period: float = 2,
+        schedulers: Optional[List[PollScheduler]] = None,
+    ):
+        self._scrappers = scrappers
+        periods = periods or [period] * len(scrappers)
+        self._schedulers = schedulers or [
+            AdaptiveScheduler(scrapper_period) for scrapper_period in periods
+        ]
+        self.subscribe(self.on_stock_event)
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._errors = {}
+        self._polled = set()
+
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._tasks = []
+
+    @property
+    def sku_name_map(self) -> Dict[str, str]:
+        sku_name_map = {}
+        for scrapper in self._scrappers:
+            sku_name_map.update(scrapper.sku_name_map)
+        return sku_name_map
+
+    def subscribe(self, callback: Callable[[str, str, str], None]) -> None:
+        """Register a stock event callback on every scrapper. It is called from
+        the polling threads.
+        """
+        for scrapper in self._scrappers:
+            scrapper.subscribe(callback)
+
+    def on_stock_event(self, event: str, gpu: str, product_url: str) -> None:
+        # A new URL usually means a drop is being prepared: poll faster
+        if event == "new_url":
+            for scheduler in self._schedulers:
+                scheduler.burst()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self._scrappers), thread_name_prefix=f"{__title__}-poll"
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name=f"{__title__}-scrapper", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._cancel_tasks)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        for scrapper in self._scrappers:
+            scrapper.close()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
+
+    def scrap(self) -> Dict[str, str]:
+        """Return the GPUs found available by any scrapper since the last call.
+        Raise a ``NvidiaApiError`` if every scrapper failed in the meantime and
+        nothing was found before. It carries the status code of the first HTTP
+        error, so that the caller scheduler backs off as well.
+        """
+        self.start()
+
+        with self._lock:
+            urls_to_try = self._pending
+            errors = self._errors
+            polled = self._polled
+            self._pending = {}
+            self._errors = {}
+            self._polled = set()
+
+        if errors and not (polled - set(errors)) and not urls_to_try:
+            status_codes = [
+                exc.status_code
+                for exc in errors.values()
+                if getattr(exc, "status_code", None) is not None
+            ]
+            raise NvidiaApiError(
+                "; ".join(f"{scr.locale}: {exc}" for scr, exc in errors.items()),
+                status_codes[0] if status_codes else None,
+            )
+
+        return urls_to_try
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._tasks = [
+            self._loop.create_task(self.poll(scrapper, scheduler))
+            for scrapper, scheduler in zip(self._scrappers, self._schedulers)
+        ]
+        try:
+            self._loop.run_until_complete(
+                asyncio.gather(*self._tasks, return_exceptions=True)
+            )
+        finally:
+            self._loop.close()
+
+    def _cancel_tasks(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+    async def poll(self, scrapper: NvidiaApiScrapper, scheduler: PollScheduler) -> None:
+        while True:
+            scheduler.poll_started()
+            try:
+                urls_to_try = await self._loop.run_in_executor(
+                    self._executor, scrapper.scrap
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"Scrapping error ({scrapper.locale}): {exc}")
+                scheduler.poll_failed(exc)
+                with self._lock:
+                    self._polled.add(scrapper)
+                    self._errors[scrapper] = exc
+            else:
+                scheduler.poll_succeeded()
+                with self._lock:
+                    self._polled.add(scrapper)
+                    self._errors.pop(scrapper, None)
+                    self._pending.update(urls_to_try)
+
+            await asyncio.sleep(scheduler.next_delay())
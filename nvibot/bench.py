@@ -0,0 +1,169 @@
+# coding=utf-8
+
+"""End-to-end latency benchmark against the local stand-ins of the Nvidia API
+and of the LDLC site. Each run flips a SKU in stock at a random instant, and
+measures from that instant:
+
+- the detection latency, until the scrapper reports the GPU
+- the time to cart and the time to order, until the LDLC stand-in records
+  them (with ``--browser``, which requires Firefox)
+
+Example:
+
+    $ python -m nvibot.bench --runs 20 --period 1 --browser
+"""
+
+import time
+import random
+import argparse
+import logging
+import statistics
+from typing import Dict, List, Optional, Sequence
+
+from . import __title__
+from . import jsonlib
+from .notifiers import LogNotifier
+from .nvidia_api import NvidiaApiScrapper
+from .scheduler import PollScheduler
+from .secrets import StaticSecretManager
+from .standins import NvidiaStandIn, LdlcStandIn
+
+logger = logging.getLogger(__title__)
+
+
+BENCH_SECRETS = {
+    "ldlc": jsonlib.dumps({"user": "bench@example.com", "password": "bench"}),
+    "cc": jsonlib.dumps(
+        {"number": "4000000000000000", "exp_date": "12/30", "owner": "B", "cpt": "0"}
+    ),
+}
+
+
+def percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    if len(samples) < 2:
+        value = samples[0] if samples else float("nan")
+        return {"p50": value, "p90": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98]}
+
+
+class Benchmark:
+    """Run the flip, detect and buy cycles against the stand-ins.
+
+    :param nvidia: the Nvidia API stand-in
+    :param ldlc: the LDLC stand-in
+    :param period: poll period of the scrapper, in seconds
+    :param fe_sku: the flipped SKU
+    :param ldlc_driver: a started LDLC driver on the stand-in, or None to only
+        measure the detection
+    """
+
+    def __init__(
+        self,
+        nvidia: NvidiaStandIn,
+        ldlc: LdlcStandIn,
+        period: float,
+        fe_sku: str,
+        ldlc_driver=None,
+    ):
+        self._nvidia = nvidia
+        self._ldlc = ldlc
+        self._scheduler = PollScheduler(period)
+        self._period = period
+        self._fe_sku = fe_sku
+        self._ldlc_driver = ldlc_driver
+
+        self._scrapper = NvidiaApiScrapper(LogNotifier(), timeout=2)
+        self._scrapper.api_url = nvidia.api_url
+        self._gpu = self._scrapper.sku_name_map[fe_sku]
+
+        self.samples = {"detect": [], "cart": [], "order": []}
+
+    def run(self, runs: int) -> Dict[str, List[float]]:
+        for number in range(runs):
+            self.run_once(number)
+        self._scrapper.close()
+        return self.samples
+
+    def run_once(self, number: int) -> None:
+        product_id = f"BE{number:08d}"
+        product_url = self._ldlc.product_url(product_id)
+
+        # Start out of stock, then flip at a random instant of the poll cycle
+        self._nvidia.flip(self._fe_sku, False)
+        self._ldlc.set_available(product_id, False)
+        self._scrapper.scrap()
+        self._ldlc.set_available(product_id, True)
+        self._nvidia.schedule(
+            random.uniform(0, self._period), self._fe_sku, True, product_url
+        )
+
+        while True:
+            self._scheduler.wait()
+            urls = self._scrapper.scrap()
+            if urls.get(self._gpu) == product_url:
+                break
+        flip_time = self._nvidia.flip_times[self._fe_sku]
+        self.samples["detect"].append(time.perf_counter() - flip_time)
+
+        if self._ldlc_driver is None:
+            return
+
+        self._ldlc_driver.buy(product_url)
+        self.samples["cart"].append(self._ldlc.cart_times[-1] - flip_time)
+        self.samples["order"].append(self._ldlc.order_times[-1] - flip_time)
+
+
+def report(samples: Dict[str, List[float]]) -> str:
+    lines = [f"{'':<8}{'runs':>6}{'p50':>10}{'p90':>10}{'p99':>10}"]
+    for name, values in samples.items():
+        if not values:
+            continue
+        cuts = percentiles(values)
+        lines.append(
+            f"{name:<8}{len(values):>6}"
+            + "".join(f"{cuts[p] * 1000:>8.1f}ms" for p in ("p50", "p90", "p99"))
+        )
+    return "\n".join(lines)
+
+
+def run_bench(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(f"{__title__}.bench")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--period", type=float, default=1)
+    parser.add_argument("--timeout", type=int, default=2)
+    parser.add_argument("--fe-sku", default=next(iter(NvidiaApiScrapper.sku_name_map)))
+    parser.add_argument(
+        "--browser", action="store_true", help="also buy through Firefox"
+    )
+    parser.add_argument("--http-checkout", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with NvidiaStandIn() as nvidia, LdlcStandIn() as ldlc:
+        if not args.browser:
+            samples = Benchmark(nvidia, ldlc, args.period, args.fe_sku).run(args.runs)
+        else:
+            from .ldlc_driver import LdlcDriver
+
+            notifier = LogNotifier()
+            ldlc_driver = LdlcDriver(
+                notifier,
+                StaticSecretManager("bench", BENCH_SECRETS),
+                timeout=args.timeout,
+                base_url=ldlc.url + "/",
+                http_checkout=args.http_checkout,
+            )
+            with ldlc_driver:
+                ldlc_driver.ensure_logged_in()
+                benchmark = Benchmark(
+                    nvidia, ldlc, args.period, args.fe_sku, ldlc_driver
+                )
+                samples = benchmark.run(args.runs)
+
+    print(report(samples))
+
+
+if __name__ == "__main__":
+    run_bench()
@@ -0,0 +1,119 @@
+# coding=utf-8
+
+from typing import Iterable, Optional
+from urllib.parse import quote
+
+from selenium.webdriver.firefox.options import Options
+
+PAC_TEMPLATE = """function FindProxyForURL(url, host) {{
+    var blocked = [{domains}];
+    for (var i = 0; i < blocked.length; i++) {{
+        if (host == blocked[i] || dnsDomainIs(host, "." + blocked[i])) {{
+            return "PROXY 127.0.0.1:9";
+        }}
+    }}
+    return "DIRECT";
+}}"""
+
+
+class BrowserProfile:
+    """Firefox settings of the LDLC driver. The default profile is lean: it
+    skips every resource the buying flow does not need, and returns from page
+    loads as soon as the DOM is ready.
+
+    Blocked domains are routed by a proxy auto-config script to a closed local
+    port, so their requests fail immediately.
+
+    :param headless: run Firefox without a display
+    :param block_images: disable image loading
+    :param block_fonts: disable downloadable fonts
+    :param block_media: disable audio and video autoplay
+    :param block_stylesheets: disable stylesheets. Off by default, as element
+        visibility (and so clickability) depends on them
+    :param block_trackers: enable Firefox tracking protection
+    :param blocked_domains: domains (and their subdomains) never contacted.
+        Defaults to common analytics and ad domains
+    :param page_load_strategy: "eager" returns once the DOM is ready, "normal"
+        once every resource is loaded
+    """
+
+    default_blocked_domains = (
+        "google-analytics.com",
+        "googletagmanager.com",
+        "googleadservices.com",
+        "doubleclick.net",
+        "facebook.net",
+        "facebook.com",
+        "criteo.com",
+        "criteo.net",
+        "hotjar.com",
+        "bing.com",
+        "adnxs.com",
+        "abtasty.com",
+        "kameleoon.eu",
+        "trustpilot.com",
+    )
+
+    def __init__(
+        self,
+        headless: bool = True,
+        block_images: bool = True,
+        block_fonts: bool = True,
+        block_media: bool = True,
+        block_stylesheets: bool = False,
+        block_trackers: bool = True,
+        blocked_domains: Optional[Iterable[str]] = None,
+        page_load_strategy: str = "eager",
+    ):
+        self.headless = headless
+        self.block_images = block_images
+        self.block_fonts = block_fonts
+        self.block_media = block_media
+        self.block_stylesheets = block_stylesheets
+        self.block_trackers = block_trackers
+        if blocked_domains is None:
+            blocked_domains = self.default_blocked_domains
+        self.blocked_domains = list(blocked_domains)
+        self.page_load_strategy = page_load_strategy
+
+    @classmethod
+    def full(cls, headless: bool = True) -> "BrowserProfile":
+        """A profile loading every resource, as a regular browser does."""
+        return cls(
+            headless=headless,
+            block_images=False,
+            block_fonts=False,
+            block_media=False,
+            block_trackers=False,
+            blocked_domains=[],
+            page_load_strategy="normal",
+        )
+
+    def pac_url(self) -> str:
+        domains = ", ".join(f'"{domain}"' for domain in self.blocked_domains)
+        return "data:text/javascript," + quote(PAC_TEMPLATE.format(domains=domains))
+
+    def options(self) -> Options:
+        options = Options()
+        options.headless = self.headless
+        options.page_load_strategy = self.page_load_strategy
+
+        if self.block_images:
+            options.set_preference("permissions.default.image", 2)
+        if self.block_fonts:
+            options.set_preference("gfx.downloadable_fonts.enabled", False)
+        if self.block_media:
+            options.set_preference("media.autoplay.default", 5)
+            options.set_preference("media.autoplay.blocking_policy", 2)
+        if self.block_stylesheets:
+            options.set_preference("permissions.default.stylesheet", 2)
+        if self.block_trackers:
+            options.set_preference("privacy.trackingprotection.enabled", True)
+            options.set_preference(
+                "privacy.trackingprotection.socialtracking.enabled", True
+            )
+        if self.blocked_domains:
+            options.set_preference("network.proxy.type", 2)
+            options.set_preference("network.proxy.autoconfig_url", self.pac_url())
+
+        return options
@@ -0,0 +1,168 @@
+# coding=utf-8
+
+"""Sampling of the browser memory and responsiveness, deciding when a long
+running Firefox should be recycled. ``LdlcDriverPool`` acts on the decision:
+a replacement is warmed up in the background, then swapped in between
+transactions.
+
+Example:
+
+    >>> watchdog = BrowserWatchdog(max_rss_mib=1024, max_response_time=2)
+        LdlcDriverPool(new_ldlc_driver, 1, watchdog=watchdog)
+"""
+
+import os
+import logging
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from . import __title__
+from . import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__title__)
+
+
+RSS_BUCKETS = (128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096)
+
+
+def process_stat(pid: Union[int, str] = "self") -> List[str]:
+    """Return the fields of ``/proc/<pid>/stat`` following the command name,
+    the process state first. Raise ``OSError`` off Linux.
+    """
+    with open(f"/proc/{pid}/stat") as stat_file:
+        # The command name may contain spaces, fields follow the last ")"
+        return stat_file.read().rsplit(")", 1)[1].split()
+
+
+def process_tree(pid: int) -> List[int]:
+    """Return a process and its descendants, read from /proc. Off Linux, only
+    the process itself is returned.
+    """
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return [pid]
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            parent = int(process_stat(entry)[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    tree = [pid]
+    for process in tree:
+        tree.extend(children.get(process, []))
+    return tree
+
+
+def process_rss(pid: int) -> int:
+    """Return the resident set size of a process in bytes, 0 if unknown."""
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def process_tree_rss(pid: int) -> int:
+    """Return the summed resident set sizes of a process and its descendants,
+    in bytes. Pages shared between processes are counted once per process,
+    so the sum overestimates the actual footprint.
+
+    psutil is used when installed (``pip install nvibot[watchdog]``), /proc
+    otherwise.
+    """
+    if psutil is None:
+        return sum(process_rss(process) for process in process_tree(pid))
+
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return 0
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+class BrowserHealth(NamedTuple):
+    rss: int
+    response_time: Optional[float]
+    age: float
+
+    @property
+    def rss_mib(self) -> float:
+        return self.rss / (1024 * 1024)
+
+
+class BrowserWatchdog:
+    """Thresholds past which a browser is recycled. A browser that does not
+    answer at all is left to the pool health checks.
+
+    :param max_rss_mib: resident set size of the browser process tree, in MiB.
+        None for no limit
+    :param max_response_time: time taken by a trivial script, in seconds.
+        None for no limit
+    :param max_age: browser age, in seconds. None for no limit
+    :param period: time between two samples of an idle browser, in seconds
+    """
+
+    def __init__(
+        self,
+        max_rss_mib: Optional[float] = 1024,
+        max_response_time: Optional[float] = 2,
+        max_age: Optional[float] = None,
+        period: float = 60,
+    ):
+        self.max_rss_mib = max_rss_mib
+        self.max_response_time = max_response_time
+        self.max_age = max_age
+        self.period = period
+
+    def sample(self, driver) -> BrowserHealth:
+        """Sample an LDLC driver. It must not be running a transaction."""
+        pid = driver.browser_pid
+        health = BrowserHealth(
+            process_tree_rss(pid) if pid is not None else 0,
+            driver.response_time(),
+            driver.age,
+        )
+
+        metrics.histogram("browser_rss_mib", buckets=RSS_BUCKETS).observe(
+            health.rss_mib
+        )
+        if health.response_time is not None:
+            metrics.histogram("browser_response_seconds").observe(health.response_time)
+        logger.debug(
+            f"Browser {pid}: RSS {health.rss_mib:.0f} MiB, response time "
+            f"{health.response_time}, age {health.age / 3600:.1f}h"
+        )
+        return health
+
+    def recycle_reason(self, health: BrowserHealth) -> Optional[str]:
+        """Return why the sampled browser should be recycled, if it should."""
+        if self.max_rss_mib is not None and health.rss_mib > self.max_rss_mib:
+            return "memory"
+        if (
+            self.max_response_time is not None
+            and health.response_time is not None
+            and health.response_time > self.max_response_time
+        ):
+            return "latency"
+        if self.max_age is not None and health.age > self.max_age:
+            return "age"
+        return None
@@ -0,0 +1,130 @@
+# coding=utf-8
+
+"""Command line plumbing shared by the entry points: ``nvibot``,
+``nvibot.watch`` and ``nvibot.multi_buyer``. Only the light dependencies are
+imported, the watch-only mode relies on it.
+
+Example:
+
+    >>> parser = argparse.ArgumentParser(__title__)
+        add_common_arguments(parser)
+        args = parser.parse_args()
+        setup(args)
+        notifier = build_notifier(args, secrets.get_manager("buyer", args.secrets))
+        nvidia_scrapper = build_scrapper(args, notifier)
+"""
+
+import sys
+import argparse
+import logging
+from typing import List
+
+from . import __title__
+from . import metrics
+from . import secrets
+from .notifiers import Notifier, PushoverNotifier, DiscordNotifier
+from .nvidia_api import NvidiaApiScrapper
+from .async_scrapper import AsyncNvidiaScrapper
+from .event_log import StockEventLog
+
+logger = logging.getLogger(__title__)
+
+
+def add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the polling, notification, secret and metrics arguments."""
+    parser.add_argument("--timeout", type=int, default=2)
+    parser.add_argument(
+        "--notifier", choices=["discord", "pushover"], default="discord"
+    )
+    parser.add_argument("--period", type=float, default=2)
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        help="hedge the polls slower than this latency percentile",
+    )
+    parser.add_argument("--secrets", choices=secrets.BACKENDS, help="secret backend")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics there")
+    parser.add_argument("--metrics-file", help="periodically write metrics there")
+    parser.add_argument("--event-log", help="log the stock transitions there")
+    parser.add_argument(
+        "--locales", nargs="+", default=[NvidiaApiScrapper.api_params["locale"]]
+    )
+
+
+def add_checkout_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments of the LDLC drivers."""
+    parser.add_argument(
+        "--transaction-budget",
+        type=float,
+        default=600,
+        help="time budget of a purchase up to the payment submission, in seconds",
+    )
+    parser.add_argument(
+        "--http-checkout",
+        action="store_true",
+        help="add to cart and select the delivery through direct HTTP requests",
+    )
+    parser.add_argument(
+        "--full-browser",
+        action="store_true",
+        help="load every page resource instead of using the lean browser profile",
+    )
+
+
+def check_gpus(
+    parser: argparse.ArgumentParser, args: argparse.Namespace, gpus: List[str]
+) -> None:
+    """Exit with a usage error if a GPU is not sold in the polled locales."""
+    gpu_choices = [
+        gpu
+        for locale in args.locales
+        for gpu in NvidiaApiScrapper.locale_sku_name_map(locale).values()
+    ]
+    for gpu in gpus:
+        if gpu not in gpu_choices:
+            parser.error(f"invalid choice: {gpu} (choose from {gpu_choices})")
+
+
+def setup(args: argparse.Namespace) -> None:
+    """Initialize the logging, then serve or export the metrics if asked."""
+    logging.basicConfig(
+        stream=sys.stderr, format="%(asctime)s - %(levelname)s: %(message)s"
+    )
+    logger.setLevel(logging.DEBUG)
+
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    if args.metrics_file is not None:
+        metrics.export_periodically(args.metrics_file)
+
+
+def build_notifier(
+    args: argparse.Namespace, secret_manager: secrets.SecretManager
+) -> Notifier:
+    if args.notifier == "discord":
+        return DiscordNotifier(secret_manager)
+    return PushoverNotifier(secret_manager)
+
+
+def build_scrapper(args: argparse.Namespace, notifier: Notifier):
+    """Return the Nvidia API scrapper of the polled locales, polling them
+    concurrently when there are several. The stock events are logged if
+    asked.
+    """
+    scrappers = [
+        NvidiaApiScrapper.for_locale(
+            notifier,
+            args.timeout,
+            locale,
+            preconnect=True,
+            hedge_percentile=args.hedge_percentile,
+        )
+        for locale in args.locales
+    ]
+    if args.event_log is not None:
+        event_log = StockEventLog(args.event_log)
+        for scrapper in scrappers:
+            event_log.attach(scrapper)
+    if len(scrappers) == 1:
+        return scrappers[0]
+    return AsyncNvidiaScrapper(scrappers, period=args.period)
@@ -0,0 +1,79 @@
+# coding=utf-8
+
+import os
+import base64
+import hashlib
+import tempfile
+import logging
+from typing import List, Optional
+
+from . import __title__
+from . import jsonlib
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__title__)
+
+
+class CookieJar:
+    """Browser cookies persisted in a file, encrypted with a key derived from
+    a secret (``pip install nvibot[cookies]``). The file holds a random salt
+    followed by a Fernet token.
+
+    :param path: the cookie file
+    :param secret: the key material, e.g. the account password
+    :param max_age: age after which stored cookies are ignored, in seconds
+    """
+
+    salt_size = 16
+    kdf_iterations = 200_000
+
+    def __init__(self, path: str, secret: str, max_age: int = 30 * 24 * 3600):
+        if Fernet is None:
+            raise ImportError("cookie persistence requires the cryptography package")
+
+        self._path = os.path.expanduser(path)
+        self._secret = secret.encode()
+        self._max_age = max_age
+
+    def _fernet(self, salt: bytes) -> "Fernet":
+        key = hashlib.pbkdf2_hmac("sha256", self._secret, salt, self.kdf_iterations)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def save(self, cookies: List[dict]) -> None:
+        salt = os.urandom(self.salt_size)
+        token = self._fernet(salt).encrypt(jsonlib.dumps(cookies).encode())
+
+        # Write then rename, so that a reader never sees a partial file. Each
+        # write has its own temporary file (private to the user), as pool
+        # drivers may save concurrently
+        directory = os.path.dirname(self._path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(self._path)}.", dir=directory
+        )
+        try:
+            with os.fdopen(fd, "wb") as cookie_file:
+                cookie_file.write(salt + token)
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self) -> Optional[List[dict]]:
+        """Return the stored cookies, or None if there are none usable."""
+        try:
+            with open(self._path, "rb") as cookie_file:
+                content = cookie_file.read()
+        except FileNotFoundError:
+            return None
+
+        salt, token = content[: self.salt_size], content[self.salt_size :]
+        try:
+            return jsonlib.loads(self._fernet(salt).decrypt(token, self._max_age))
+        except (InvalidToken, ValueError):
+            logger.warning(f"Ignoring invalid or expired cookie file {self._path}")
+            return None
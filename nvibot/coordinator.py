@@ -0,0 +1,64 @@
+# coding=utf-8
+
+import threading
+from typing import Iterable, List, Optional
+
+
+class BuyCoordinator:
+    """Thread safe bookkeeping of the purchases of a bot. Products must be
+    reserved before a transaction attempt: reservations follow the buy
+    priority, and bought plus in-flight products never exceed the buy limit,
+    even when attempts run concurrently.
+
+    :param buy_priority: the list of selected GPU models
+    :param buy_limit: the maximum number of models to buy
+    """
+
+    def __init__(self, buy_priority: List[str], buy_limit: int):
+        self._buy_priority = buy_priority.copy()
+        self._buy_limit = buy_limit
+
+        self._bought = set()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return len(self._bought) >= self._buy_limit
+
+    @property
+    def buy_priority(self) -> List[str]:
+        with self._lock:
+            return self._buy_priority.copy()
+
+    def reserve(
+        self, products: Iterable[str], max_count: Optional[int] = None
+    ) -> List[str]:
+        """Reserve the available products to attempt, by priority order. Return
+        the reserved products, which must then be committed or released.
+        """
+        available = set(products)
+        with self._lock:
+            slots = self._buy_limit - len(self._bought) - len(self._in_flight)
+            if max_count is not None:
+                slots = min(slots, max_count)
+
+            reserved = []
+            for product in self._buy_priority:
+                if len(reserved) >= slots:
+                    break
+                if product in available and product not in self._in_flight:
+                    reserved.append(product)
+
+            self._in_flight.update(reserved)
+            return reserved
+
+    def commit(self, product: str) -> None:
+        with self._lock:
+            self._in_flight.discard(product)
+            self._buy_priority.remove(product)
+            self._bought.add(product)
+
+    def release(self, product: str) -> None:
+        with self._lock:
+            self._in_flight.discard(product)
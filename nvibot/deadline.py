@@ -0,0 +1,68 @@
+# coding=utf-8
+
+import time
+from typing import List, Optional, Tuple
+
+from .retailer import RetailerError
+
+
+class DeadlineExceeded(RetailerError):
+    pass
+
+
+class Deadline:
+    """The time budget of a transaction, shared by all its steps and waits.
+    Each wait is bounded by what is left of the budget, and the time spent in
+    each step is recorded.
+
+    :param budget: the time budget, in seconds. None for no limit
+
+    Example:
+
+        >>> deadline = Deadline(600)
+            WebDriverWait(driver, deadline.timeout(2)).until(...)
+            deadline.record("checkout", 1.2)
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget
+        self.start = time.perf_counter()
+        self.steps: List[Tuple[str, float]] = []
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def remaining(self) -> float:
+        if self.budget is None:
+            return float("inf")
+        return self.budget - self.elapsed
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.expired:
+            raise DeadlineExceeded(
+                f"Transaction budget of {self.budget}s exceeded ({self.report()})"
+            )
+
+    def timeout(self, timeout: float) -> float:
+        """Bound a wait timeout by the remaining budget."""
+        self.check()
+        return min(timeout, self.remaining())
+
+    def disarm(self) -> None:
+        """Stop enforcing the budget, e.g. once a payment is submitted and must
+        not be aborted anymore. Steps are still recorded.
+        """
+        self.budget = None
+
+    def record(self, step: str, elapsed: float) -> None:
+        self.steps.append((step, elapsed))
+
+    def report(self) -> str:
+        steps = ", ".join(f"{step} {elapsed:.2f}s" for step, elapsed in self.steps)
+        budget = "" if self.budget is None else f" of {self.budget}s"
+        return f"{steps or 'no step'}; {self.elapsed:.2f}s{budget}"
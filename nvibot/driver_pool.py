@@ -0,0 +1,286 @@
+# coding=utf-8
+
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+from . import __title__
+from . import metrics
+from .ldlc_driver import (
+    LdlcDriver,
+    UrlNotAvailable,
+    CartAddFailure,
+    PayementRefused,
+)
+from .retailer import RetailerError, RetailerAborted
+from .deadline import DeadlineExceeded
+from .browser_watchdog import BrowserWatchdog
+
+logger = logging.getLogger(__title__)
+
+
+# Transaction errors that say nothing about the browser health
+TRANSACTION_ERRORS = (
+    UrlNotAvailable,
+    CartAddFailure,
+    PayementRefused,
+    RetailerAborted,
+    DeadlineExceeded,
+)
+
+
+class NoDriverAvailable(RetailerError):
+    pass
+
+
+class LdlcDriverPool:
+    """A pool of warm LDLC drivers: browsers are launched, past the cookie
+    consent and logged in by background threads, and their health is checked
+    periodically. Crashed or logged out browsers are replaced in the
+    background, so launch and login costs stay off the buying path.
+
+    With a watchdog, idle browsers are also sampled, and recycled once they
+    grow too large or slow: a replacement is warmed up with the session of
+    the old browser, which is only discarded once the replacement is idle in
+    the pool. A browser running a transaction is swapped after it.
+
+    The pool exposes the ``LdlcDriver`` interface and can replace it in
+    ``Nvibot``: ``buy`` runs on the first warm driver available.
+
+    :param factory: builds a new LDLC driver, not entered yet
+    :param size: number of warm drivers to keep
+    :param health_period: time between two health checks, in seconds
+    :param retry_delay: time waited after a failed warm up, in seconds
+    :param watchdog: decides when browsers are recycled. None to keep them
+        until they fail a health check
+    :param acquire_timeout: time waited for a warm driver before raising
+        ``NoDriverAvailable``, in seconds
+
+    Example:
+
+        >>> with LdlcDriverPool(lambda: LdlcDriver(notifier, secret_manager)) as pool:
+                pool.ensure_logged_in()
+                pool.buy(url)
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], LdlcDriver],
+        size: int = 2,
+        health_period: float = 300,
+        retry_delay: float = 10,
+        watchdog: Optional[BrowserWatchdog] = None,
+        acquire_timeout: float = 300,
+    ):
+        self._factory = factory
+        self._size = size
+        self._health_period = health_period
+        self._retry_delay = retry_delay
+        self._watchdog = watchdog
+        self._acquire_timeout = acquire_timeout
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        # Drivers waiting for their replacement, and those to discard on release
+        self._retiring = set()
+        self._retired = set()
+        self._stopping = threading.Event()
+        self._health_thread = None
+
+    def __enter__(self):
+        self._stopping.clear()
+        for _ in range(self._size):
+            self.spawn()
+
+        self._health_thread = threading.Thread(
+            target=self._check_health, name=f"{__title__}-pool-health", daemon=True
+        )
+        self._health_thread.start()
+
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self._stopping.set()
+        self._health_thread.join()
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+    def ensure_logged_in(self) -> None:
+        """Wait for the first warm driver, the pool drivers log in by
+        themselves.
+        """
+        self.release(self.acquire())
+
+    def buy(self, url: str) -> None:
+        with self.driver() as driver:
+            driver.buy(url)
+
+    @contextmanager
+    def driver(self) -> Iterator[LdlcDriver]:
+        """Borrow a warm driver. A driver whose transaction failed on something
+        else than the product or the payment is checked in the background
+        before being handed out again.
+        """
+        driver = self.acquire()
+        try:
+            yield driver
+        except TRANSACTION_ERRORS:
+            self.release(driver)
+            raise
+        except:
+            threading.Thread(target=self.recheck, args=(driver,), daemon=True).start()
+            raise
+        else:
+            self.release(driver)
+
+    def acquire(self) -> LdlcDriver:
+        try:
+            return self._idle.get(timeout=self._acquire_timeout)
+        except queue.Empty:
+            raise NoDriverAvailable(
+                f"No warm LDLC driver available after {self._acquire_timeout}s"
+            )
+
+    def release(self, driver: LdlcDriver) -> None:
+        with self._lock:
+            retired = driver in self._retired
+        if self._stopping.is_set() or retired:
+            self.discard(driver)
+        else:
+            self._idle.put(driver)
+
+    def recheck(self, driver: LdlcDriver) -> None:
+        if driver.is_healthy():
+            self.release(driver)
+        else:
+            logger.warning("Unhealthy LDLC driver, replacing it")
+            with self._lock:
+                # Its replacement is already warming up
+                replaced = driver in self._retiring
+            self.discard(driver)
+            if not replaced:
+                self.spawn()
+
+    def inspect(self, driver: LdlcDriver) -> None:
+        """Sample an idle driver, and start its replacement if the watchdog
+        says so. The driver stays in the pool until the replacement is ready.
+        """
+        with self._lock:
+            retiring = driver in self._retiring
+        if not retiring:
+            reason = self._watchdog.recycle_reason(self._watchdog.sample(driver))
+            if reason is not None:
+                self.replace(driver, reason)
+        self.release(driver)
+
+    def replace(self, driver: LdlcDriver, reason: str) -> None:
+        logger.info(f"Recycling LDLC driver ({reason})")
+        metrics.counter("browser_recycles_total").inc(reason=reason)
+        try:
+            cookies = driver.session_cookies()
+        except Exception as exc:
+            logger.warning(f"Session cookies not copied: {exc}")
+            cookies = None
+        with self._lock:
+            self._retiring.add(driver)
+        self.spawn(driver, cookies)
+
+    def retire(self, driver: LdlcDriver) -> None:
+        """Discard a replaced driver: now if idle, else on its release."""
+        with self._lock:
+            if driver not in self._retiring:
+                # Already discarded by a health check
+                return
+            self._retired.add(driver)
+            idle = []
+            found = False
+            while True:
+                try:
+                    idle_driver = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if idle_driver is driver:
+                    found = True
+                else:
+                    idle.append(idle_driver)
+            for idle_driver in idle:
+                self._idle.put(idle_driver)
+        if found:
+            self.discard(driver)
+
+    def discard(self, driver: LdlcDriver) -> None:
+        with self._lock:
+            self._retiring.discard(driver)
+            self._retired.discard(driver)
+        try:
+            driver.__exit__(None, None, None)
+        except Exception as exc:
+            logger.error(f"Driver shutdown failed: {exc}")
+
+    def spawn(
+        self,
+        replaces: Optional[LdlcDriver] = None,
+        cookies: Optional[List[dict]] = None,
+    ) -> None:
+        threading.Thread(
+            target=self._warm_up,
+            args=(replaces, cookies),
+            name=f"{__title__}-pool-warmup",
+            daemon=True,
+        ).start()
+
+    def _warm_up(
+        self,
+        replaces: Optional[LdlcDriver] = None,
+        cookies: Optional[List[dict]] = None,
+    ) -> None:
+        while not self._stopping.is_set():
+            start = time.perf_counter()
+            driver = None
+            try:
+                driver = self._factory()
+                driver.__enter__()
+                driver.ensure_logged_in(cookies)
+            except Exception as exc:
+                logger.error(f"Driver warm up failed: {exc}")
+                if driver is not None:
+                    self.discard(driver)
+                self._stopping.wait(self._retry_delay)
+            else:
+                elapsed = time.perf_counter() - start
+                logger.info(f"Warm LDLC driver ready in {elapsed:.1f}s")
+                self.release(driver)
+                if replaces is not None:
+                    self.retire(replaces)
+                return
+
+    def _check_health(self) -> None:
+        period = self._health_period
+        if self._watchdog is not None:
+            period = min(period, self._watchdog.period)
+        last_check = time.monotonic()
+
+        while not self._stopping.wait(period):
+            check = time.monotonic() - last_check >= self._health_period
+            if check:
+                last_check = time.monotonic()
+            elif self._watchdog is None:
+                continue
+
+            # Check idle drivers one at a time, the others stay available
+            for _ in range(self._idle.qsize()):
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if check:
+                    self.recheck(driver)
+                else:
+                    self.inspect(driver)
@@ -0,0 +1,299 @@
+# coding=utf-8
+
+"""Append-only binary log of the SKU transitions observed by the scrappers,
+and drop statistics computed from it.
+
+The file is a 16 bytes header followed by fixed size records: timestamp,
+locale, SKU, is_active and a hash of the product URL. The writer keeps no
+event in memory, and the reader memory-maps the file, so months of events are
+queried without loading them.
+
+Example:
+
+    >>> StockEventLog("events.bin").attach(nvidia_scrapper)
+
+    $ python -m nvibot.event_log stats events.bin --days 30
+"""
+
+import os
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+import logging
+import statistics
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from . import __title__
+from .nvidia_api import NvidiaApiScrapper
+
+logger = logging.getLogger(__title__)
+
+
+MAGIC = b"NVEVLOG1"
+HEADER = struct.Struct("<8sH6x")
+RECORD = struct.Struct("<d8s24s?7x8s")
+
+
+def url_hash(product_url: str) -> bytes:
+    return hashlib.blake2b(product_url.encode(), digest_size=8).digest()
+
+
+class StockEvent(NamedTuple):
+    timestamp: float
+    locale: str
+    sku: str
+    is_active: bool
+    url_hash: bytes
+
+
+class Drop(NamedTuple):
+    """A period during which a SKU was in stock."""
+
+    locale: str
+    sku: str
+    start: float
+    end: Optional[float]
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+
+class StockEventLog:
+    """Append SKU transitions to a stock event log file. Only transitions are
+    written: a SKU observed again in the same state is skipped.
+
+    :param path: the log file, created if needed
+    """
+
+    def __init__(self, path: str):
+        self._path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        # Last (is_active, url hash) per (locale, SKU), bounded by the SKU count
+        self._last = {}
+
+        self._file = open(self._path, "ab", buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, RECORD.size))
+        else:
+            reader = StockEventReader(self._path)
+            self._last = reader.last_states()
+            reader.close()
+            # Drop a partially written last record, left by a crash
+            self._file.truncate(HEADER.size + len(reader) * RECORD.size)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def append(
+        self,
+        locale: str,
+        sku: str,
+        is_active: bool,
+        product_url: str,
+        timestamp: Optional[float] = None,
+    ) -> bool:
+        """Write a transition. Return False if the state did not change."""
+        state = (is_active, url_hash(product_url))
+        with self._lock:
+            if self._last.get((locale, sku)) == state:
+                return False
+            self._last[(locale, sku)] = state
+            self._file.write(
+                RECORD.pack(
+                    timestamp or time.time(),
+                    locale.encode(),
+                    sku.encode(),
+                    is_active,
+                    state[1],
+                )
+            )
+        return True
+
+    def attach(self, scrapper: NvidiaApiScrapper) -> None:
+        """Log the transitions observed by a scrapper."""
+        gpu_sku_map = {gpu: sku for sku, gpu in scrapper.sku_name_map.items()}
+
+        def on_stock_event(event: str, gpu: str, product_url: str) -> None:
+            is_active = scrapper.sku_state(gpu).is_active
+            self.append(scrapper.locale, gpu_sku_map[gpu], is_active, product_url)
+
+        scrapper.subscribe(on_stock_event)
+
+
+class StockEventReader:
+    """Read a stock event log through a memory map. Records are sorted by
+    timestamp, as they are appended, so time ranges are found by bisection.
+
+    :param path: the log file
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.expanduser(path), "rb") as log_file:
+            header = log_file.read(HEADER.size)
+            if header and len(header) < HEADER.size:
+                raise ValueError(
+                    f"{path} is not a stock event log: truncated header "
+                    f"({len(header)} bytes out of {HEADER.size})"
+                )
+            magic, record_size = HEADER.unpack(header) if header else (MAGIC, 0)
+            if magic != MAGIC or record_size not in (0, RECORD.size):
+                raise ValueError(f"{path} is not a stock event log")
+
+            size = os.fstat(log_file.fileno()).st_size
+            # A partially written last record is ignored
+            self._count = max(0, (size - HEADER.size) // RECORD.size)
+            self._map = None
+            if self._count:
+                self._map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> StockEvent:
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        timestamp, locale, sku, is_active, hashed = RECORD.unpack_from(
+            self._map, HEADER.size + index * RECORD.size
+        )
+        return StockEvent(
+            timestamp,
+            locale.rstrip(b"\0").decode(),
+            sku.rstrip(b"\0").decode(),
+            is_active,
+            hashed,
+        )
+
+    def timestamp(self, index: int) -> float:
+        return struct.unpack_from("<d", self._map, HEADER.size + index * RECORD.size)[0]
+
+    def bisect(self, timestamp: float) -> int:
+        """Return the index of the first event at or after ``timestamp``."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def events(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        locale: Optional[str] = None,
+        sku: Optional[str] = None,
+    ) -> Iterator[StockEvent]:
+        start = 0 if since is None else self.bisect(since)
+        end = self._count if until is None else self.bisect(until)
+        for index in range(start, end):
+            event = self[index]
+            if locale is not None and event.locale != locale:
+                continue
+            if sku is not None and event.sku != sku:
+                continue
+            yield event
+
+    def last_states(self) -> Dict[Tuple[str, str], Tuple[bool, bytes]]:
+        return {
+            (event.locale, event.sku): (event.is_active, event.url_hash)
+            for event in self.events()
+        }
+
+    def drops(self, **filters) -> List[Drop]:
+        """Return the in stock periods, the last ones possibly still open."""
+        drops = []
+        started = {}
+        for event in self.events(**filters):
+            key = (event.locale, event.sku)
+            if event.is_active and key not in started:
+                started[key] = event.timestamp
+            elif not event.is_active and key in started:
+                drops.append(Drop(*key, started.pop(key), event.timestamp))
+        drops.extend(Drop(*key, start, None) for key, start in started.items())
+        return sorted(drops, key=lambda drop: drop.start)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+
+
+def drop_stats(drops: List[Drop]) -> Dict[Tuple[str, str], dict]:
+    """Summarize drops per (locale, SKU): count, durations, usual hours and
+    week days.
+    """
+    per_sku = {}
+    for drop in drops:
+        per_sku.setdefault((drop.locale, drop.sku), []).append(drop)
+
+    stats = {}
+    for key, sku_drops in per_sku.items():
+        durations = [drop.duration for drop in sku_drops if drop.end is not None]
+        starts = [datetime.fromtimestamp(drop.start) for drop in sku_drops]
+        stats[key] = {
+            "count": len(sku_drops),
+            "last": max(drop.start for drop in sku_drops),
+            "median_duration": statistics.median(durations) if durations else None,
+            "max_duration": max(durations) if durations else None,
+            "hours": Counter(start.hour for start in starts).most_common(3),
+            "weekdays": Counter(start.strftime("%a") for start in starts).most_common(
+                3
+            ),
+        }
+    return stats
+
+
+def run_event_log(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(f"{__title__}.event_log")
+    parser.add_argument("command", choices=["stats", "drops", "dump"])
+    parser.add_argument("path")
+    parser.add_argument("--days", type=float, help="only the last days")
+    parser.add_argument("--locale")
+    parser.add_argument("--sku")
+    args = parser.parse_args(argv)
+
+    since = None if args.days is None else time.time() - args.days * 24 * 3600
+    filters = {"since": since, "locale": args.locale, "sku": args.sku}
+    reader = StockEventReader(args.path)
+
+    def when(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+    if args.command == "dump":
+        for event in reader.events(**filters):
+            state = "in stock" if event.is_active else "out of stock"
+            print(
+                f"{when(event.timestamp)} {event.locale} {event.sku} {state} "
+                f"{event.url_hash.hex()}"
+            )
+    elif args.command == "drops":
+        for drop in reader.drops(**filters):
+            duration = "ongoing" if drop.end is None else f"{drop.duration:.1f}s"
+            print(f"{when(drop.start)} {drop.locale} {drop.sku} {duration}")
+    else:
+        for (locale, sku), stats in drop_stats(reader.drops(**filters)).items():
+            median = stats["median_duration"]
+            median = "-" if median is None else f"{median:.1f}s"
+            hours = ", ".join(f"{hour}h ({count})" for hour, count in stats["hours"])
+            days = ", ".join(f"{day} ({count})" for day, count in stats["weekdays"])
+            print(
+                f"{locale} {sku}: {stats['count']} drops, last {when(stats['last'])}, "
+                f"median duration {median}, hours {hours}, days {days}"
+            )
+    reader.close()
+
+
+if __name__ == "__main__":
+    run_event_log()
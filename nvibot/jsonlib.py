@@ -0,0 +1,49 @@
+# coding=utf-8
+
+"""JSON helpers using orjson when it is installed (``pip install nvibot[fast]``),
+and the standard library otherwise.
+"""
+
+import json
+import hashlib
+import reprlib
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_repr = reprlib.Repr()
+_repr.maxstring = 128
+_repr.maxother = 128
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def summarize(data: Any, limit: int = 256) -> str:
+    """Return a bounded description of a payload, cheap to build and to log:
+    a truncated snippet followed by the payload size and digest for raw
+    bodies, or a size-bounded repr for decoded objects.
+    """
+    if isinstance(data, str):
+        data = data.encode(errors="replace")
+
+    if isinstance(data, (bytes, bytearray)):
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        snippet = data[:limit].decode(errors="replace")
+        ellipsis = "..." if len(data) > limit else ""
+        return f"{snippet}{ellipsis} ({len(data)} bytes, digest {digest})"
+
+    return _repr.repr(data)[:limit]
@@ -1,395 +1,777 @@
-# coding=utf-8
-
-import os
-import logging
-import time
-from urllib.parse import urlparse
-
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException
-
-from . import __title__
-from .notifiers import Notifier
-from .secrets import SecretManager
-
-logger = logging.getLogger(__title__)
-
-
-CHRONOPOST_ID = "SelectedDeliveryModeId370008"
-CHRONOPOST_EXP_ID = "SelectedDeliveryModeId370009"
-
-
-class LdlcError(Exception):
-    pass
-
-
-class UrlNotAvailable(LdlcError):
-    pass
-
-
-class CartAddFailure(LdlcError):
-    pass
-
-
-class CallFailed(LdlcError):
-    pass
-
-
-class PayementRefused(LdlcError):
-    pass
-
-
-def stubborn_call(method):
-    """Decorates a method to make it retry until it fails enough attempt. It
-    extracts the folowing keyword arguments.
-
-    :param max_attemps: number of attempts before giving up
-    :param sleep_for: how much time slept between attempts
-    """
-
-    def decorated(self, *args, **kwargs):
-        max_attemps = kwargs.pop("max_attemps", 5)
-        sleep_for = kwargs.pop("sleep_for", 2)
-        nb_attemps = 0
-        while nb_attemps < max_attemps:
-            nb_attemps = nb_attemps + 1
-            try:
-                return method(self, *args, **kwargs)
-            except (UrlNotAvailable, CartAddFailure):
-                raise
-            except Exception as exc:
-                if "maintenance" in self._driver.title:
-                    logger.error(f"Cat page (attempt {nb_attemps})")
-                else:
-                    logger.error(
-                        f"Attempt failed (attempt {nb_attemps}). Page title: {self._driver.title}"
-                    )
-                    logger.exception(exc)
-
-            time.sleep(sleep_for)
-
-        logger.error(f"Max stubborn_buy attempts reached ({max_attemps})")
-        raise CallFailed()
-
-    return decorated
-
-
-class LdlcDriver:
-    """An LDLC buying driver, over a Selenium Firefox driver. It should be used
-    inside as a contect manager.
-
-    :param notifier: used to push the driver notifications
-    :param secret_manager: used to retrieve credentials and credit cards
-        informations
-    :param timeout: used to wait various event by the driver
-
-    Example:
-
-        >>> with LdlcDriver(notifier, secret_manager) as ldlc:
-                ldlc.login()
-                ldlc.buy(url)
-    """
-
-    url = "https://www.ldlc.com"
-
-    def __init__(
-        self, notifier: Notifier, secret_manager: SecretManager, timeout: int = 2
-    ):
-        credentials = secret_manager.get("ldlc", json=True)
-        self._ldlc_user = credentials["user"]
-        self._ldlc_password = credentials["password"]
-        self._cc = secret_manager.get("cc", json=True)
-
-        self._driver = None
-        self._notifier = notifier
-        self._timeout = timeout
-        self._extended_timeout = timeout * 3
-
-    def __enter__(self):
-        options = Options()
-        options.headless = True
-        self._driver = webdriver.Firefox(
-            options=options, service_log_path=os.path.devnull
-        )
-        self._driver.set_page_load_timeout(self._timeout)
-
-        self.accept_cookies()
-
-        return self
-
-    def __exit__(self, *args, **kwargs):
-        return self._driver.__exit__(*args, **kwargs)
-
-    def accept_cookies(self) -> None:
-        self._driver.get("https://www.ldlc.com")
-
-        # Accept cookie if needed
-        ldlc_cookies = [
-            ck["name"]
-            for ck in self._driver.get_cookies()
-            if ck["domain"] == ".ldlc.com"
-        ]
-        if "cookiespreferences" not in ldlc_cookies:
-            logger.info(f"Accept cookie")
-            cookie_accept_elt = WebDriverWait(
-                self._driver, self._extended_timeout
-            ).until(EC.element_to_be_clickable((By.ID, "cookieConsentAcceptButton")))
-            cookie_accept_elt.click()
-
-    @stubborn_call
-    def login(self) -> None:
-        self._driver.get("https://www.ldlc.com")
-
-        # Small wait 'cause we often yield a cat page on login
-        time.sleep(1)
-
-        # Login
-        logger.info(f"Loging in")
-        account_elt = self._driver.find_element(By.ID, "compte")
-        account_elt.click()
-        stay_connectd_elt = self._driver.find_element(
-            By.ID, "LongAuthenticationDuration"
-        )
-        stay_connectd_elt.click()
-        email_elt = self._driver.find_element(By.ID, "Email")
-        email_elt.send_keys(self._ldlc_user)
-        ldlc_pw_elt = self._driver.find_element(By.ID, "Password")
-        ldlc_pw_elt.send_keys(self._ldlc_password)
-
-        ldlc_pw_elt.send_keys(Keys.RETURN)
-
-        # Wait until the login worked
-        WebDriverWait(self._driver, self._timeout).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "a.logout"))
-        )
-        self._notifier.push(f"Loging successful")
-
-    @stubborn_call
-    def buy(self, url: str) -> None:
-        self.ensure_empty_basket()
-        self.get_and_ensure_url(url)
-        self.checkout()
-        self.ensure_home_delivery()
-        self.order()
-        self.wait_3ds()
-
-        # Final small wait
-        time.sleep(2)
-
-    def ensure_empty_basket(self) -> None:
-        self._driver.get("https://www.ldlc.com")
-        basket_elt = self._driver.find_element(By.ID, "panier")
-        try:
-            basket_elt.find_element(By.CSS_SELECTOR, "span.nb-pdt")
-        except:
-            pass
-        else:
-            logger.info(f"Basket is not empty")
-            basket_elt.click()
-            trash_icon_elt = WebDriverWait(self._driver, self._timeout).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "span.icon-trash"))
-            )
-            trash_link_elt = trash_icon_elt.find_element(By.XPATH, "./..")
-            trash_link_elt.click()
-            trash_icon_elt = WebDriverWait(self._driver, self._timeout).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "span.icon-trash"))
-            )
-            confirm_button_elt = WebDriverWait(self._driver, self._timeout).until(
-                EC.element_to_be_clickable((By.PARTIAL_LINK_TEXT, "OUI"))
-            )
-            confirm_button_elt.click()
-            logger.info(f"Successfully emptied the basket")
-
-    def get_and_ensure_url(self, url: str) -> None:
-        logger.info(f"Get {url}")
-        self._driver.get(url)
-
-        url_ready = False
-        try:
-            self._driver.find_element(By.CSS_SELECTOR, "div.p410")
-        except:
-            try:
-                self._driver.find_element(By.CSS_SELECTOR, "div.p404")
-            except:
-                url_ready = True
-
-        if not url_ready:
-            self._notifier.humble_push(f"{url} is not ready")
-            raise UrlNotAvailable()
-
-    def checkout(self) -> None:
-        logger.info(f"Add product in cart")
-
-        try:
-            WebDriverWait(self._driver, self._timeout).until(
-                EC.element_to_be_clickable(
-                    (By.CSS_SELECTOR, "button.add-to-cart-oneclic")
-                )
-            )
-        except:
-            we_left_the_page = self.cart_checkout()
-        else:
-            we_left_the_page = self.one_click_checkout()
-
-        # Check if we are still on the page in which case we have most likely been
-        # offered an extended waranty: we refuse
-        if not we_left_the_page:
-            logger.info(f"Still on the page: extended warranty refusal tentative")
-            try:
-                refuse_elt = WebDriverWait(self._driver, self._extended_timeout).until(
-                    EC.element_to_be_clickable((By.LINK_TEXT, "NON MERCI"))
-                )
-                refuse_elt.click()
-                logger.info(f"Refused extended warranty")
-            except:
-                logger.info(f"Warranty refusal failed")
-
-    def one_click_checkout(self) -> None:
-        # Get reference of generic modals to react to
-        default_modal_elt = self._driver.find_element(By.ID, "modal-default")
-        generic_modal_elt = self._driver.find_element(By.ID, "error-generic-modal")
-
-        buy_elt = self._driver.find_element(
-            By.CSS_SELECTOR, "button.add-to-cart-oneclic"
-        )
-        buy_elt.click()
-        logger.info(f"Instant checkout was available")
-
-        # Check for cart add error. Also capture stale error to check if we left
-        # the page or not
-        try:
-            if generic_modal_elt.is_displayed() or default_modal_elt.is_displayed():
-                self._notifier.humble_push(f"Modal error: cart add failed")
-                raise CartAddFailure()
-        except StaleElementReferenceException:
-            we_left_the_page = True
-        else:
-            we_left_the_page = False
-
-        return we_left_the_page
-
-    def cart_checkout(self) -> None:
-        logger.info(f"Switching to manual cart checkout")
-        add_cart_elt = WebDriverWait(self._driver, self._extended_timeout).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "button.add-to-cart"))
-        )
-        add_cart_elt.click()
-
-        see_cart_elt = WebDriverWait(self._driver, self._extended_timeout).until(
-            EC.element_to_be_clickable((By.PARTIAL_LINK_TEXT, "VOIR MON PANIER"))
-        )
-        see_cart_elt.click()
-
-        order_div_elt = self._driver.find_element(By.ID, "order")
-        checkout_elt = order_div_elt.find_element(By.CSS_SELECTOR, "button.maxi")
-        checkout_elt.click()
-
-        # Test if the clicked element is stale, in which case we left the page
-        try:
-            checkout_elt.is_enabled()
-        except StaleElementReferenceException:
-            we_left_the_page = True
-        else:
-            we_left_the_page = False
-
-        return we_left_the_page
-
-    def ensure_home_delivery(self) -> None:
-        logger.info(f"Ensuring home delivery")
-
-        # First wait for the (hopefully) allways present regular chronopost option
-        chronop_radio_elt = self.wait_staleness((By.ID, CHRONOPOST_ID))
-        if chronop_radio_elt.get_attribute("selected") != "true":
-            logger.info(f"Switching to regular chronopost")
-            chronop_div_elt = chronop_radio_elt.find_element(By.XPATH, "./..")
-            chronop_div_elt.click()
-            self.wait_staleness((By.ID, "CardNumber"))
-        else:
-            logger.info(f"Chronopost already selected")
-
-    def try_express_delivery(self) -> None:
-        logger.info(f"Try express delivery")
-
-        # First wait for the (hopefully) allways present regular chronopost option
-        chronop_radio_elt = self.wait_staleness((By.ID, CHRONOPOST_ID))
-
-        try:
-            # Then tries to activate the express option
-            chronop_radio_exp_elt = self._driver.find_element(By.ID, CHRONOPOST_EXP_ID)
-            if chronop_radio_exp_elt.get_attribute("selected") != "true":
-                logger.info(f"Switching to chronopost express")
-                chronop_div_elt = chronop_radio_exp_elt.find_element(By.XPATH, "./..")
-                chronop_div_elt.click()
-                self.wait_staleness((By.ID, "CardNumber"))
-            else:
-                logger.info(f"Chronopost express already selected")
-        except:
-            logger.info(f"Chronopost express unavailable")
-            if chronop_radio_elt.get_attribute("selected") != "true":
-                logger.info(f"Switching to regular chronopost")
-                chronop_div_elt = chronop_radio_elt.find_element(By.XPATH, "./..")
-                chronop_div_elt.click()
-                self.wait_staleness((By.ID, "CardNumber"))
-            else:
-                logger.info(f"Chronopost already selected")
-
-    def order(self) -> None:
-        logger.info(f"Placing order")
-
-        # Processing credit card informations
-        logger.info(f"Filling payement informations")
-        card_nb_elt = self._driver.find_element(By.ID, "CardNumber")
-        card_nb_elt.send_keys(self._cc["number"])
-        exp_date_elt = self._driver.find_element(By.ID, "ExpirationDate")
-        exp_date_elt.send_keys(self._cc["exp_date"])
-        owner_elt = self._driver.find_element(By.ID, "OwnerName")
-        owner_elt.send_keys(self._cc["owner"])
-        cpt_elt = self._driver.find_element(By.ID, "Cryptogram")
-        cpt_elt.send_keys(self._cc["cpt"])
-
-        logger.info(f"Submiting payement")
-        payment_div_elt = self._driver.find_element(By.ID, "payment-form")
-        pay_elt = payment_div_elt.find_element(By.CSS_SELECTOR, "button.maxi")
-        pay_elt.click()
-
-        try:
-            error_elt = WebDriverWait(self._driver, self._extended_timeout).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, "span.field-validation-error")
-                )
-            )
-        except:
-            logger.info(f"Payement accepted")
-        else:
-            self._notifier.push(f"Payement error: {error_elt.text}")
-            raise PayementRefused()
-
-    def wait_3ds(self) -> None:
-        self._notifier.push(f"Waiting for 3DS approval")
-        time.sleep(2)
-        while "ldlc.com" not in urlparse(self._driver.current_url).netloc:
-            time.sleep(1)
-
-        self._notifier.push(f"Back to LDLC in page '{self._driver.title}'")
-        logger.info(f"Back to LDLC in page '{self._driver.title}'")
-
-    def wait_staleness(self, locator):
-        logger.info(f"Waiting for DOM stabilization on {locator}")
-
-        # Here we wait for some strange DOM movements to happen
-        elt = WebDriverWait(self._driver, self._timeout).until(
-            EC.presence_of_element_located(locator)
-        )
-        try:
-            WebDriverWait(self._driver, self._timeout).until(EC.staleness_of(elt))
-        except:
-            logger.debug(f"DOM stabilization not needed")
-        elt = WebDriverWait(self._driver, self._timeout).until(
-            EC.presence_of_element_located(locator)
-        )
-        return elt
+# coding=utf-8
+
+import os
+import logging
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Iterator, List, Optional
+from urllib.parse import urlparse
+
+from selenium import webdriver
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    TimeoutException,
+)
+
+from . import __title__
+from . import metrics
+from .notifiers import Notifier
+from .secrets import SecretManager
+from .retry import RetryPolicy, Attempt, CAT_PAGE
+from .browser import BrowserProfile
+from .cookie_jar import CookieJar
+from .ldlc_http import LdlcHttpCheckout, FastPathUnavailable
+from .retailer import (
+    RetailerDriver,
+    RetailerError,
+    RetailerAborted,
+    PaymentOutcomeUnknown,
+)
+from .deadline import Deadline, DeadlineExceeded
+
+logger = logging.getLogger(__title__)
+
+
+CHRONOPOST_ID = "SelectedDeliveryModeId370008"
+CHRONOPOST_EXP_ID = "SelectedDeliveryModeId370009"
+
+
+class LdlcError(RetailerError):
+    pass
+
+
+class UrlNotAvailable(LdlcError):
+    pass
+
+
+class CartAddFailure(LdlcError):
+    pass
+
+
+class CallFailed(LdlcError):
+    pass
+
+
+class PayementRefused(LdlcError):
+    pass
+
+
+def stubborn_call(method):
+    """Decorates a method to make it retry until it fails enough attempt. The
+    driver retry policy is used, unless overriden by the following keyword
+    argument. Every attempt is recorded in the driver ``attempts`` list.
+
+    The call runs as a transaction, within the driver time budget unless
+    overriden by the following keyword argument.
+
+    :param retry_policy: a ``RetryPolicy`` used for this call
+    :param deadline: a ``Deadline`` used for this call
+    """
+
+    @wraps(method)
+    def decorated(self, *args, **kwargs):
+        policy = kwargs.pop("retry_policy", self._retry_policy)
+        deadline = kwargs.pop("deadline", None)
+        with self.transaction(deadline) as deadline:
+            self.attempts = []
+            start = time.perf_counter()
+            nb_attemps = 0
+            while True:
+                nb_attemps = nb_attemps + 1
+                attempt_start = time.perf_counter()
+                try:
+                    return method(self, *args, **kwargs)
+                except (
+                    UrlNotAvailable,
+                    CartAddFailure,
+                    PayementRefused,
+                    RetailerAborted,
+                    DeadlineExceeded,
+                    PaymentOutcomeUnknown,
+                ):
+                    raise
+                except Exception as exc:
+                    try:
+                        title = self._driver.title
+                    except Exception:
+                        title = ""
+                    category = policy.classify(exc, title)
+                    if category == CAT_PAGE:
+                        logger.error(f"Cat page (attempt {nb_attemps})")
+                    else:
+                        logger.error(
+                            f"Attempt failed (attempt {nb_attemps}, {category}). Page title: {title}"
+                        )
+                        logger.exception(exc)
+
+                now = time.perf_counter()
+                delay = policy.delay(category, nb_attemps)
+                metrics.counter("stubborn_retries_total").inc(
+                    method=method.__name__, category=category
+                )
+                metrics.histogram("stubborn_attempt_seconds").observe(
+                    now - attempt_start, method=method.__name__
+                )
+                self.attempts.append(
+                    Attempt(nb_attemps, category, now - attempt_start, delay)
+                )
+                logger.debug(f"Attempt {nb_attemps} took {now - attempt_start:.2f}s")
+                if not policy.should_retry(nb_attemps, now - start, delay):
+                    break
+                if delay >= deadline.remaining():
+                    deadline.check()
+                    raise DeadlineExceeded(f"No time left for attempt {nb_attemps + 1}")
+
+                time.sleep(delay)
+
+            logger.error(f"Stubborn call gave up after {nb_attemps} attempts")
+            raise CallFailed()
+
+    return decorated
+
+
+def transaction_step(method):
+    """Decorates a buying step to check the transaction deadline before it
+    starts, and record its duration.
+    """
+
+    @wraps(method)
+    def decorated(self, *args, **kwargs):
+        if self._deadline is not None:
+            self._deadline.check()
+        start = time.perf_counter()
+        try:
+            with metrics.span("ldlc_step", step=method.__name__):
+                return method(self, *args, **kwargs)
+        finally:
+            if self._deadline is not None:
+                self._deadline.record(method.__name__, time.perf_counter() - start)
+
+    return decorated
+
+
+class LdlcDriver(RetailerDriver):
+    """An LDLC buying driver, over a Selenium Firefox driver. It should be used
+    inside as a contect manager.
+
+    :param notifier: used to push the driver notifications
+    :param secret_manager: used to retrieve credentials and credit cards
+        informations
+    :param timeout: used to wait various event by the driver
+    :param retry_policy: how ``login`` and ``buy`` are retried
+    :param profile: Firefox settings. Defaults to a lean ``BrowserProfile``
+    :param cookie_path: file where the session cookies are persisted, encrypted
+        with the LDLC password. None to log in on each start
+    :param base_url: LDLC site URL, e.g. to target a local stand-in
+    :param http_checkout: add to cart and select the delivery with direct HTTP
+        requests, falling back to the browser on anything unexpected
+    :param transaction_budget: time budget of a transaction up to the payment
+        submission, in seconds. Past it, the transaction is aborted and the
+        basket emptied. The 3DS approval is never aborted. None for no limit
+    :param approval_timeout: time waited for the 3DS approval, in seconds. Past
+        it, the order is reported as pending with ``PaymentOutcomeUnknown``
+
+    Example:
+
+        >>> with LdlcDriver(notifier, secret_manager) as ldlc:
+                ldlc.ensure_logged_in()
+                ldlc.buy(url)
+    """
+
+    url = "https://www.ldlc.com"
+
+    def __init__(
+        self,
+        notifier: Notifier,
+        secret_manager: SecretManager,
+        timeout: int = 2,
+        retry_policy: Optional[RetryPolicy] = None,
+        profile: Optional[BrowserProfile] = None,
+        cookie_path: Optional[str] = None,
+        base_url: Optional[str] = None,
+        http_checkout: bool = False,
+        transaction_budget: Optional[float] = 600,
+        approval_timeout: float = 900,
+    ):
+        super().__init__()
+        if base_url is not None:
+            self.url = base_url
+
+        credentials = secret_manager.get("ldlc", json=True)
+        self._ldlc_user = credentials["user"]
+        self._ldlc_password = credentials["password"]
+        self._cc = secret_manager.get("cc", json=True)
+
+        self._driver = None
+        # True when our own actions filled the basket, None when unknown
+        self._basket_filled = None
+        self._notifier = notifier
+        self._timeout = timeout
+        self._extended_timeout = timeout * 3
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._profile = profile or BrowserProfile()
+        self._http_checkout = None
+        if http_checkout:
+            self._http_checkout = LdlcHttpCheckout(self.url, timeout)
+        self._cookie_jar = None
+        if cookie_path is not None:
+            self._cookie_jar = CookieJar(cookie_path, self._ldlc_password)
+        self.attempts = []
+        self._transaction_budget = transaction_budget
+        self._approval_timeout = approval_timeout
+        self._deadline = None
+        self._started = None
+
+    def __enter__(self):
+        self._driver = webdriver.Firefox(
+            options=self._profile.options(), service_log_path=os.path.devnull
+        )
+        self._started = time.monotonic()
+        self._driver.set_page_load_timeout(self._timeout)
+
+        self.accept_cookies()
+
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        if self._http_checkout is not None:
+            self._http_checkout.close()
+        return self._driver.__exit__(*args, **kwargs)
+
+    def wait(self, timeout: float, **kwargs) -> WebDriverWait:
+        """A Selenium wait, bounded by the transaction deadline if any."""
+        if self._deadline is not None:
+            timeout = self._deadline.timeout(timeout)
+        return WebDriverWait(self._driver, timeout, **kwargs)
+
+    @contextmanager
+    def transaction(self, deadline: Optional[Deadline] = None) -> Iterator[Deadline]:
+        """Run a transaction within a deadline, by default one of the driver
+        time budget. In a running transaction, its deadline is reused.
+
+        Past the deadline, the basket is emptied and ``DeadlineExceeded``
+        raised. The time spent in each step is logged in any case.
+        """
+        if self._deadline is not None:
+            yield self._deadline
+            return
+
+        self._deadline = deadline or Deadline(self._transaction_budget)
+        try:
+            yield self._deadline
+        except DeadlineExceeded:
+            self._notifier.push(f"Transaction aborted: {self._deadline.report()}")
+            self._deadline = None
+            self.abort_transaction()
+            raise
+        finally:
+            if self._deadline is not None:
+                logger.info(f"Transaction steps: {self._deadline.report()}")
+            self._deadline = None
+
+    def abort_transaction(self) -> None:
+        if self._basket_filled is False:
+            return
+        try:
+            self.empty_basket()
+        except Exception as exc:
+            self._basket_filled = None
+            self._notifier.push(f"Basket clean up failed: {exc}")
+
+    @property
+    def site_domain(self) -> str:
+        hostname = urlparse(self.url).hostname
+        return hostname[4:] if hostname.startswith("www.") else hostname
+
+    def accept_cookies(self) -> None:
+        self._driver.get(self.url)
+
+        # Accept cookie if needed
+        ldlc_cookies = [
+            ck["name"]
+            for ck in self._driver.get_cookies()
+            if ck["domain"].lstrip(".") == self.site_domain
+        ]
+        if "cookiespreferences" not in ldlc_cookies:
+            logger.info(f"Accept cookie")
+            cookie_accept_elt = self.wait(self._extended_timeout).until(
+                EC.element_to_be_clickable((By.ID, "cookieConsentAcceptButton"))
+            )
+            cookie_accept_elt.click()
+
+    @property
+    def age(self) -> float:
+        """Time since the browser started, in seconds."""
+        return time.monotonic() - self._started
+
+    @property
+    def browser_pid(self) -> Optional[int]:
+        """The geckodriver process, the Firefox processes are its descendants."""
+        process = getattr(getattr(self._driver, "service", None), "process", None)
+        return None if process is None else process.pid
+
+    def response_time(self) -> Optional[float]:
+        """Time a trivial script round trip. None if the browser fails it."""
+        start = time.perf_counter()
+        try:
+            self._driver.execute_script("return 1")
+        except Exception as exc:
+            logger.warning(f"Browser did not respond: {exc}")
+            return None
+        return time.perf_counter() - start
+
+    def session_cookies(self) -> List[dict]:
+        return self._driver.get_cookies()
+
+    def ensure_logged_in(self, cookies: Optional[List[dict]] = None) -> None:
+        """Restore a session if it is still valid, otherwise log in and persist
+        the new session.
+
+        :param cookies: the session to restore, e.g. from another browser.
+            Defaults to the persisted session, if any
+        """
+        restored = bool(cookies) and self.restore_session(cookies)
+        if not restored and self._cookie_jar is not None:
+            restored = self.restore_session()
+        if restored:
+            self._notifier.push(f"Session restored")
+            return
+
+        self.login()
+        if self._cookie_jar is not None:
+            self._cookie_jar.save(self._driver.get_cookies())
+
+    def restore_session(self, cookies: Optional[List[dict]] = None) -> bool:
+        if cookies is None:
+            cookies = self._cookie_jar.load()
+        if not cookies:
+            return False
+
+        self._driver.get(self.url)
+        for cookie in cookies:
+            try:
+                self._driver.add_cookie(cookie)
+            except Exception as exc:
+                logger.debug(f"Cookie {cookie.get('name')} not restored: {exc}")
+        self._driver.refresh()
+
+        # The session is valid if we are logged in
+        try:
+            self.wait(self._timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "a.logout"))
+            )
+        except TimeoutException:
+            logger.info(f"Restored session is not logged in")
+            return False
+        return True
+
+    @stubborn_call
+    def login(self) -> None:
+        self._driver.get(self.url)
+
+        # Wait for the login entry, as we often yield a cat page on login
+        account_elt = self.wait(self._extended_timeout).until(
+            EC.element_to_be_clickable((By.ID, "compte"))
+        )
+
+        # Login
+        logger.info(f"Loging in")
+        account_elt.click()
+        stay_connectd_elt = self._driver.find_element(
+            By.ID, "LongAuthenticationDuration"
+        )
+        stay_connectd_elt.click()
+        email_elt = self._driver.find_element(By.ID, "Email")
+        email_elt.send_keys(self._ldlc_user)
+        ldlc_pw_elt = self._driver.find_element(By.ID, "Password")
+        ldlc_pw_elt.send_keys(self._ldlc_password)
+
+        ldlc_pw_elt.send_keys(Keys.RETURN)
+
+        # Wait until the login worked
+        self.wait(self._timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "a.logout"))
+        )
+        self._notifier.push(f"Loging successful")
+
+    def is_healthy(self) -> bool:
+        """Check that the browser responds and is still logged in."""
+        try:
+            self._driver.get(self.url)
+            self._driver.find_element(By.CSS_SELECTOR, "a.logout")
+        except Exception as exc:
+            logger.warning(f"LDLC driver health check failed: {exc}")
+            return False
+        return True
+
+    def buy(self, url: str) -> None:
+        """Reach the payment page, retried if needed, then pay. The payment is
+        never retried.
+        """
+        with self.transaction():
+            self.reach_payment(url)
+            self.pay()
+
+    @stubborn_call
+    def reach_payment(self, url: str) -> None:
+        # The deadline keyword argument is handled by stubborn_call
+        self.go_to_payment(url)
+
+    def go_to_payment(self, url: str) -> None:
+        self.ensure_empty_basket()
+        self.check_aborted()
+        if not self.fast_checkout(url):
+            self.get_and_ensure_url(url)
+            self.check_aborted()
+            self.checkout()
+            self.check_aborted()
+            self.ensure_home_delivery()
+
+    def pay(self, deadline: Optional[Deadline] = None) -> None:
+        """Place the order and wait for its approval. The transaction budget
+        only applies until the payment is submitted.
+
+        Any failure after the payment submission raises
+        ``PaymentOutcomeUnknown``.
+
+        :param deadline: the deadline of the transaction, when ``pay`` is called
+            apart from ``reach_payment``
+        """
+        with self.transaction(deadline):
+            self.order()
+            self._basket_filled = None
+            try:
+                self.wait_3ds()
+                # Let the final page settle
+                self.wait_page_loaded()
+            except PaymentOutcomeUnknown:
+                raise
+            except Exception as exc:
+                raise PaymentOutcomeUnknown(
+                    f"Payment submitted, then the browser failed: {exc}"
+                ) from exc
+
+    @transaction_step
+    def fast_checkout(self, url: str) -> bool:
+        """Reach the payment page through the HTTP fast path, if enabled.
+        Return False when the browser flow should be used instead.
+        """
+        if self._http_checkout is None:
+            return False
+
+        logger.info(f"HTTP fast checkout of {url}")
+        try:
+            # The fast path never sees the basket badge: check it if unknown
+            if self._basket_filled is None:
+                self.empty_basket()
+
+            self._http_checkout.load_cookies(
+                self._driver.get_cookies(),
+                self._driver.execute_script("return navigator.userAgent"),
+            )
+            self._http_checkout.add_to_cart(url)
+            self._basket_filled = True
+            self._http_checkout.select_delivery(
+                CHRONOPOST_ID[len("SelectedDeliveryModeId") :]
+            )
+
+            # Hand the session back to the browser for the payment
+            for cookie in self._http_checkout.cookies():
+                self._driver.add_cookie(cookie)
+            self._driver.get(self._http_checkout.payment_url)
+            self._driver.find_element(By.ID, "CardNumber")
+        except FastPathUnavailable:
+            self._notifier.humble_push(f"{url} is not ready")
+            raise UrlNotAvailable()
+        except Exception as exc:
+            logger.warning(f"HTTP fast path failed, back to the browser: {exc}")
+            if self._basket_filled:
+                self.empty_basket()
+            return False
+
+        logger.info(f"HTTP fast path reached the payment page")
+        return True
+
+    def cancel(self) -> None:
+        self.empty_basket()
+
+    @transaction_step
+    def ensure_empty_basket(self) -> None:
+        # Otherwise the basket is verified lazily, on the product page
+        if self._basket_filled:
+            self.empty_basket()
+
+    def basket_badge_displayed(self) -> bool:
+        """Check the basket badge of the current page header."""
+        return bool(self._driver.find_elements(By.CSS_SELECTOR, "#panier span.nb-pdt"))
+
+    @transaction_step
+    def empty_basket(self) -> None:
+        self._driver.get(self.url)
+        basket_elt = self._driver.find_element(By.ID, "panier")
+        try:
+            basket_elt.find_element(By.CSS_SELECTOR, "span.nb-pdt")
+        except:
+            pass
+        else:
+            logger.info(f"Basket is not empty")
+            basket_elt.click()
+            trash_icon_elt = self.wait(self._timeout).until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, "span.icon-trash"))
+            )
+            trash_link_elt = trash_icon_elt.find_element(By.XPATH, "./..")
+            trash_link_elt.click()
+            trash_icon_elt = self.wait(self._timeout).until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, "span.icon-trash"))
+            )
+            confirm_button_elt = self.wait(self._timeout).until(
+                EC.element_to_be_clickable((By.PARTIAL_LINK_TEXT, "OUI"))
+            )
+            confirm_button_elt.click()
+            logger.info(f"Successfully emptied the basket")
+        self._basket_filled = False
+
+    @transaction_step
+    def get_and_ensure_url(self, url: str) -> None:
+        logger.info(f"Get {url}")
+        self._driver.get(url)
+        self.ensure_url_ready(url)
+
+        # Lazy basket verification, from the header of the page we load anyway
+        if self.basket_badge_displayed():
+            logger.info(f"Stale basket contents")
+            self.empty_basket()
+            # The product page may have gone meanwhile
+            self._driver.get(url)
+            self.ensure_url_ready(url)
+        self._basket_filled = False
+
+    def ensure_url_ready(self, url: str) -> None:
+        """Raise ``UrlNotAvailable`` if the loaded product page is a 404 or
+        410 page.
+        """
+        url_ready = False
+        try:
+            self._driver.find_element(By.CSS_SELECTOR, "div.p410")
+        except:
+            try:
+                self._driver.find_element(By.CSS_SELECTOR, "div.p404")
+            except:
+                url_ready = True
+
+        if not url_ready:
+            self._notifier.humble_push(f"{url} is not ready")
+            raise UrlNotAvailable()
+
+    @transaction_step
+    def checkout(self) -> None:
+        logger.info(f"Add product in cart")
+        self._basket_filled = True
+
+        try:
+            self.wait(self._timeout).until(
+                EC.element_to_be_clickable(
+                    (By.CSS_SELECTOR, "button.add-to-cart-oneclic")
+                )
+            )
+        except:
+            we_left_the_page = self.cart_checkout()
+        else:
+            we_left_the_page = self.one_click_checkout()
+
+        # Check if we are still on the page in which case we have most likely been
+        # offered an extended waranty: we refuse
+        if not we_left_the_page:
+            logger.info(f"Still on the page: extended warranty refusal tentative")
+            try:
+                refuse_elt = self.wait(self._extended_timeout).until(
+                    EC.element_to_be_clickable((By.LINK_TEXT, "NON MERCI"))
+                )
+                refuse_elt.click()
+                logger.info(f"Refused extended warranty")
+            except:
+                logger.info(f"Warranty refusal failed")
+
+    def one_click_checkout(self) -> None:
+        # Get reference of generic modals to react to
+        default_modal_elt = self._driver.find_element(By.ID, "modal-default")
+        generic_modal_elt = self._driver.find_element(By.ID, "error-generic-modal")
+
+        buy_elt = self._driver.find_element(
+            By.CSS_SELECTOR, "button.add-to-cart-oneclic"
+        )
+        buy_elt.click()
+        logger.info(f"Instant checkout was available")
+
+        # Check for cart add error. Also capture stale error to check if we left
+        # the page or not
+        try:
+            if generic_modal_elt.is_displayed() or default_modal_elt.is_displayed():
+                self._notifier.humble_push(f"Modal error: cart add failed")
+                raise CartAddFailure()
+        except StaleElementReferenceException:
+            we_left_the_page = True
+        else:
+            we_left_the_page = False
+
+        return we_left_the_page
+
+    def cart_checkout(self) -> None:
+        logger.info(f"Switching to manual cart checkout")
+        add_cart_elt = self.wait(self._extended_timeout).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, "button.add-to-cart"))
+        )
+        add_cart_elt.click()
+
+        see_cart_elt = self.wait(self._extended_timeout).until(
+            EC.element_to_be_clickable((By.PARTIAL_LINK_TEXT, "VOIR MON PANIER"))
+        )
+        see_cart_elt.click()
+
+        order_div_elt = self._driver.find_element(By.ID, "order")
+        checkout_elt = order_div_elt.find_element(By.CSS_SELECTOR, "button.maxi")
+        checkout_elt.click()
+
+        # Test if the clicked element is stale, in which case we left the page
+        try:
+            checkout_elt.is_enabled()
+        except StaleElementReferenceException:
+            we_left_the_page = True
+        else:
+            we_left_the_page = False
+
+        return we_left_the_page
+
+    @transaction_step
+    def ensure_home_delivery(self) -> None:
+        logger.info(f"Ensuring home delivery")
+
+        # First wait for the (hopefully) allways present regular chronopost option
+        chronop_radio_elt = self.wait_staleness((By.ID, CHRONOPOST_ID))
+        if chronop_radio_elt.get_attribute("selected") != "true":
+            logger.info(f"Switching to regular chronopost")
+            chronop_div_elt = chronop_radio_elt.find_element(By.XPATH, "./..")
+            chronop_div_elt.click()
+            self.wait_staleness((By.ID, "CardNumber"))
+        else:
+            logger.info(f"Chronopost already selected")
+
+    def try_express_delivery(self) -> None:
+        logger.info(f"Try express delivery")
+
+        # First wait for the (hopefully) allways present regular chronopost option
+        chronop_radio_elt = self.wait_staleness((By.ID, CHRONOPOST_ID))
+
+        try:
+            # Then tries to activate the express option
+            chronop_radio_exp_elt = self._driver.find_element(By.ID, CHRONOPOST_EXP_ID)
+            if chronop_radio_exp_elt.get_attribute("selected") != "true":
+                logger.info(f"Switching to chronopost express")
+                chronop_div_elt = chronop_radio_exp_elt.find_element(By.XPATH, "./..")
+                chronop_div_elt.click()
+                self.wait_staleness((By.ID, "CardNumber"))
+            else:
+                logger.info(f"Chronopost express already selected")
+        except:
+            logger.info(f"Chronopost express unavailable")
+            if chronop_radio_elt.get_attribute("selected") != "true":
+                logger.info(f"Switching to regular chronopost")
+                chronop_div_elt = chronop_radio_elt.find_element(By.XPATH, "./..")
+                chronop_div_elt.click()
+                self.wait_staleness((By.ID, "CardNumber"))
+            else:
+                logger.info(f"Chronopost already selected")
+
+    @transaction_step
+    def order(self) -> None:
+        logger.info(f"Placing order")
+
+        # Processing credit card informations
+        logger.info(f"Filling payement informations")
+        card_nb_elt = self._driver.find_element(By.ID, "CardNumber")
+        card_nb_elt.send_keys(self._cc["number"])
+        exp_date_elt = self._driver.find_element(By.ID, "ExpirationDate")
+        exp_date_elt.send_keys(self._cc["exp_date"])
+        owner_elt = self._driver.find_element(By.ID, "OwnerName")
+        owner_elt.send_keys(self._cc["owner"])
+        cpt_elt = self._driver.find_element(By.ID, "Cryptogram")
+        cpt_elt.send_keys(self._cc["cpt"])
+
+        logger.info(f"Submiting payement")
+        payment_div_elt = self._driver.find_element(By.ID, "payment-form")
+        pay_elt = payment_div_elt.find_element(By.CSS_SELECTOR, "button.maxi")
+        pay_elt.click()
+
+        # The payment is submitted: the bank may approve it whatever happens
+        # next, so the transaction must not be aborted anymore
+        if self._deadline is not None:
+            self._deadline.disarm()
+
+        try:
+            error_elt = self.wait(self._extended_timeout).until(
+                EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, "span.field-validation-error")
+                )
+            )
+            error = error_elt.text
+        except TimeoutException:
+            logger.info(f"Payement accepted")
+        except Exception as exc:
+            raise PaymentOutcomeUnknown(
+                f"Payment submitted, then the browser failed: {exc}"
+            ) from exc
+        else:
+            self._notifier.push(f"Payement error: {error}")
+            raise PayementRefused()
+
+    @transaction_step
+    def wait_3ds(self) -> None:
+        self._notifier.push(f"Waiting for 3DS approval")
+
+        def on_ldlc(driver):
+            return self.site_domain in urlparse(driver.current_url).netloc
+
+        # Wait for the redirection to the bank, if any, then for the way back
+        try:
+            self.wait(self._timeout, poll_frequency=0.1).until_not(on_ldlc)
+        except TimeoutException:
+            logger.info(f"No redirection out of LDLC")
+        try:
+            self.wait(self._approval_timeout, poll_frequency=0.25).until(on_ldlc)
+        except TimeoutException:
+            self._notifier.push(
+                f"No 3DS approval after {self._approval_timeout}s, "
+                f"the order may be pending"
+            )
+            raise PaymentOutcomeUnknown(
+                f"3DS approval not completed within {self._approval_timeout}s"
+            )
+
+        self._notifier.push(f"Back to LDLC in page '{self._driver.title}'")
+        logger.info(f"Back to LDLC in page '{self._driver.title}'")
+
+    def wait_page_loaded(self) -> None:
+        try:
+            self.wait(self._extended_timeout).until(
+                lambda driver: driver.execute_script("return document.readyState")
+                == "complete"
+            )
+        except TimeoutException:
+            logger.info(f"Page still loading after {self._extended_timeout}s")
+
+    def wait_staleness(self, locator):
+        logger.info(f"Waiting for DOM stabilization on {locator}")
+
+        # Here we wait for some strange DOM movements to happen
+        elt = self.wait(self._timeout).until(EC.presence_of_element_located(locator))
+        try:
+            self.wait(self._timeout).until(EC.staleness_of(elt))
+        except:
+            logger.debug(f"DOM stabilization not needed")
+        elt = self.wait(self._timeout).until(EC.presence_of_element_located(locator))
+        return elt
@@ -0,0 +1,129 @@
+# coding=utf-8
+
+import re
+import logging
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import __title__
+from . import jsonlib
+
+logger = logging.getLogger(__title__)
+
+
+class FastPathError(Exception):
+    pass
+
+
+class FastPathUnavailable(FastPathError):
+    pass
+
+
+class LdlcHttpCheckout:
+    """Perform the add to cart and the delivery selection of an LDLC
+    transaction as direct HTTP requests, authenticated with the cookies of the
+    browser. Anything unexpected raises a ``FastPathError``, upon which the
+    caller should fall back to the browser flow.
+
+    The endpoints are class attributes, so they can follow the LDLC site.
+
+    :param base_url: LDLC site URL
+    :param timeout: HTTP timeout of a single request
+    """
+
+    product_id_pattern = re.compile(r"/fiche/(?P<product_id>[A-Z]{2}\d+)\.html")
+    cart_add_path = "/v4/fr-fr/cart/add/{product_id}"
+    delivery_path = "/v4/fr-fr/checkout/delivery"
+    payment_path = "/v4/fr-fr/checkout/payment"
+
+    def __init__(self, base_url: str, timeout: float):
+        self._base_url = base_url.rstrip("/")
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_maxsize=1))
+
+    @property
+    def payment_url(self) -> str:
+        return self._base_url + self.payment_path
+
+    def load_cookies(self, cookies: List[dict], user_agent: str) -> None:
+        """Authenticate the session as the browser."""
+        self._session.cookies.clear()
+        for cookie in cookies:
+            self._session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+        self._session.headers["user-agent"] = user_agent
+
+    def cookies(self) -> List[dict]:
+        """Return the session cookies, in the Selenium format."""
+        return [
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "secure": cookie.secure,
+            }
+            for cookie in self._session.cookies
+        ]
+
+    def product_id(self, url: str) -> str:
+        match = self.product_id_pattern.search(url)
+        if match is None:
+            raise FastPathError(f"No product id in {url}")
+        return match.group("product_id")
+
+    def add_to_cart(self, url: str) -> None:
+        path = self.cart_add_path.format(product_id=self.product_id(url))
+        reply = self.post(path, {"quantity": 1}, referer=url)
+        if reply.status_code in (404, 410):
+            raise FastPathUnavailable(f"{url} is not available")
+        self.expect(reply, 200)
+
+        try:
+            success = jsonlib.loads(reply.content).get("success")
+        except (ValueError, AttributeError):
+            success = False
+        if not success:
+            summary = jsonlib.summarize(reply.content)
+            raise FastPathError(f"Cart add refused: {summary}")
+
+    def select_delivery(self, delivery_mode_id: str) -> None:
+        reply = self.post(
+            self.delivery_path, {"SelectedDeliveryModeId": delivery_mode_id}
+        )
+        self.expect(reply, 200, 302)
+
+        # A redirection elsewhere than to the payment usually means a login page
+        location = reply.headers.get("location")
+        if location is not None and not location.endswith(self.payment_path):
+            raise FastPathError(f"Unexpected redirection to {location}")
+
+    def post(
+        self, path: str, data: dict, referer: Optional[str] = None
+    ) -> requests.Response:
+        headers = {"x-requested-with": "XMLHttpRequest"}
+        if referer is not None:
+            headers["referer"] = referer
+        return self._session.post(
+            self._base_url + path,
+            data=data,
+            headers=headers,
+            timeout=self._timeout,
+            allow_redirects=False,
+        )
+
+    def expect(self, reply: requests.Response, *status_codes: int) -> None:
+        if reply.status_code not in status_codes:
+            raise FastPathError(
+                f"{reply.request.method} {reply.url}: HTTP {reply.status_code}"
+            )
+
+    def close(self) -> None:
+        self._session.close()
@@ -0,0 +1,194 @@
+# coding=utf-8
+
+"""Minimal latency metrics: counters and histograms rendered in the Prometheus
+text format, served on a local HTTP endpoint or written to a file.
+
+Example:
+
+    >>> with metrics.span("scrap", phase="network"):
+            reply = session.get(url)
+        metrics.serve(9100)
+"""
+
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from . import __title__
+
+logger = logging.getLogger(__title__)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in key]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}"] if self.help else []
+        lines.append(f"# TYPE {self.name} counter")
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # Per label set: bucket counts (the last one is +Inf), sum
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}"] if self.help else []
+        lines.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulated = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulated += count
+                    labels = _format_labels(key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulated}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulated}")
+        return lines
+
+
+class Registry:
+    """A set of named metrics. Metrics are created on first use, and names are
+    prefixed with the package name.
+    """
+
+    def __init__(self, prefix: str = __title__):
+        self._prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args):
+        name = f"{self._prefix}_{name}"
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args)
+            return self._metrics[name]
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(
+        self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, help, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the metrics on ``http://host:port/metrics`` from a background
+        thread.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("content-type", "text/plain; version=0.0.4")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(
+            target=httpd.serve_forever, name=f"{__title__}-metrics", daemon=True
+        ).start()
+        logger.info(f"Metrics served on http://{host}:{port}/metrics")
+        return httpd
+
+    def export_periodically(self, path: str, period: float = 15) -> None:
+        """Write the metrics to a file every ``period`` seconds, from a
+        background thread.
+        """
+
+        def export():
+            while True:
+                time.sleep(period)
+                try:
+                    self.write(path)
+                except OSError as exc:
+                    logger.error(f"Metrics export failed: {exc}")
+
+        threading.Thread(
+            target=export, name=f"{__title__}-metrics", daemon=True
+        ).start()
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+serve = REGISTRY.serve
+export_periodically = REGISTRY.export_periodically
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[None]:
+    """Time a block into the ``<name>_seconds`` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram(f"{name}_seconds").observe(time.perf_counter() - start, **labels)
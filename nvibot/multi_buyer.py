@@ -0,0 +1,237 @@
+# coding=utf-8
+
+"""Multi-buyer mode: a single process polls the Nvidia API once per period and
+fans the result out to one ``Nvibot`` per buyer. Each buyer keeps its own
+secrets, notifier, driver, priority and limit, while the API load stays the
+same whatever the number of buyers.
+
+Example:
+
+    $ python -m nvibot.multi_buyer --buyer alice 3080 3070 --buyer bob:2 3090
+"""
+
+import argparse
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Union
+
+from . import __title__
+from . import secrets
+from . import cli
+from .notifiers import NotifierGroup
+from .scheduler import PollScheduler, AdaptiveScheduler
+
+logger = logging.getLogger(__title__)
+
+
+class ScrapperView:
+    """The scrapper of one buyer, fed by a ``ScrapperFanOut``. ``scrap``
+    blocks until the next shared poll, so the buyer loop needs no sleep of its
+    own: pair it with a ``PollScheduler(0)``.
+
+    When the buyer is busy, only the latest poll is kept. An error never
+    replaces a pending successful poll.
+    """
+
+    def __init__(self, fan_out: "ScrapperFanOut"):
+        self._fan_out = fan_out
+        self._latest = None
+        self._condition = threading.Condition()
+
+    @property
+    def sku_name_map(self) -> Dict[str, str]:
+        return self._fan_out.scrapper.sku_name_map
+
+    def subscribe(self, callback: Callable[[str, str, str], None]) -> None:
+        self._fan_out.scrapper.subscribe(callback)
+
+    def publish(self, result: Union[Dict[str, str], Exception]) -> None:
+        with self._condition:
+            if not (isinstance(result, Exception) and isinstance(self._latest, dict)):
+                self._latest = result
+            self._condition.notify()
+
+    def scrap(self) -> Dict[str, str]:
+        with self._condition:
+            while self._latest is None:
+                self._condition.wait()
+            result, self._latest = self._latest, None
+
+        if isinstance(result, Exception):
+            raise result
+        return dict(result)
+
+
+class ScrapperFanOut:
+    """Poll a scrapper from a background thread, and publish every result to
+    the views handed to the buyers.
+
+    :param scrapper: the polled scrapper
+    :param scheduler: decides the wait between two polls. Defaults to an
+        ``AdaptiveScheduler``
+    """
+
+    def __init__(self, scrapper, scheduler: Optional[PollScheduler] = None):
+        self.scrapper = scrapper
+        self._scheduler = scheduler or AdaptiveScheduler()
+        self._views = []
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.scrapper.subscribe(self._scheduler.on_stock_event)
+
+    def view(self) -> ScrapperView:
+        view = ScrapperView(self)
+        self._views.append(view)
+        return view
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name=f"{__title__}-fan-out", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._scheduler.wait()
+
+            self._scheduler.poll_started()
+            try:
+                result = self.scrapper.scrap()
+                self._scheduler.poll_succeeded()
+            except Exception as exc:
+                self._scheduler.poll_failed(exc)
+                result = exc
+
+            for view in self._views:
+                view.publish(result)
+
+
+class MultiBuyer:
+    """Run one bot per buyer, each in its own thread, until every bot is done.
+
+    :param fan_out: the shared scrapper poll
+    :param bots: per buyer name, a bot built on a view of ``fan_out``
+    :param notifiers: per buyer name, the notifier of the bot
+    """
+
+    def __init__(self, fan_out: ScrapperFanOut, bots: dict, notifiers: dict):
+        self._fan_out = fan_out
+        self._bots = bots
+        self._notifiers = notifiers
+
+    def run(self) -> None:
+        threads = [
+            threading.Thread(
+                target=self.run_bot, args=(buyer,), name=f"{__title__}-{buyer}"
+            )
+            for buyer in self._bots
+        ]
+        with self._fan_out:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def run_bot(self, buyer: str) -> None:
+        notifier = self._notifiers[buyer]
+        try:
+            self._bots[buyer].run()
+        except Exception as exc:
+            logger.exception(f"Bot of {buyer} failed")
+            notifier.push(f"{__title__} exited with error: {exc}")
+        finally:
+            notifier.close()
+
+
+def parse_buyer(values: List[str]) -> dict:
+    buyer, _, buy_limit = values[0].partition(":")
+    return {
+        "buyer": buyer,
+        "buy_limit": int(buy_limit or 1),
+        "buy_priority": values[1:],
+    }
+
+
+def run_multi_buyer():
+    parser = argparse.ArgumentParser(f"{__title__}.multi_buyer")
+    parser.add_argument(
+        "--buyer",
+        nargs="+",
+        action="append",
+        required=True,
+        metavar="BUYER[:LIMIT] GPU",
+        help="a buyer, its buy limit (1 by default) and its GPU priority",
+    )
+    cli.add_common_arguments(parser)
+    cli.add_checkout_arguments(parser)
+
+    args = parser.parse_args()
+
+    buyers = [parse_buyer(values) for values in args.buyer]
+    for buyer in buyers:
+        if not buyer["buy_priority"]:
+            parser.error(f"no GPU selected for {buyer['buyer']}")
+        cli.check_gpus(parser, args, buyer["buy_priority"])
+
+    # Selenium takes a while to load, do not import it to parse the arguments
+    from .nvibot import Nvibot
+    from .ldlc_driver import LdlcDriver
+    from .browser import BrowserProfile
+
+    cli.setup(args)
+
+    notifiers = {}
+    secret_managers = {}
+    for buyer in buyers:
+        name = buyer["buyer"]
+        secret_managers[name] = secrets.get_manager(name, args.secrets)
+        notifiers[name] = cli.build_notifier(args, secret_managers[name])
+        notifiers[name].push(f"{__title__} initializing")
+
+    # Stock alerts go to every buyer
+    group_notifier = NotifierGroup(list(notifiers.values()))
+    nvidia_scrapper = cli.build_scrapper(args, group_notifier)
+    fan_out = ScrapperFanOut(nvidia_scrapper, AdaptiveScheduler(args.period))
+
+    profile = BrowserProfile.full() if args.full_browser else BrowserProfile()
+    bots = {}
+    for buyer in buyers:
+        name = buyer["buyer"]
+        ldlc_driver = LdlcDriver(
+            notifiers[name],
+            secret_managers[name],
+            args.timeout,
+            profile=profile,
+            http_checkout=args.http_checkout,
+            transaction_budget=args.transaction_budget,
+        )
+        bots[name] = Nvibot(
+            ldlc_driver,
+            fan_out.view(),
+            notifiers[name],
+            buyer["buy_priority"],
+            buyer["buy_limit"],
+            PollScheduler(0),
+        )
+
+    # Run the brobots
+    try:
+        MultiBuyer(fan_out, bots, notifiers).run()
+    finally:
+        group_notifier.close()
+
+
+if __name__ == "__main__":
+    run_multi_buyer()
@@ -4,30 +4,241 @@ import requests
 import time
 import logging
 import json
+import queue
+import threading
+from collections import OrderedDict
+from typing import Optional, Hashable, Any, List
+
+from requests.adapters import HTTPAdapter
 
 from . import __title__
+from . import metrics
 from nvibot.secrets import SecretManager
 
 logger = logging.getLogger(__title__)
 
 
+class DedupCache:
+    """A bounded, thread safe mapping used to deduplicate messages. Beyond
+    ``max_size`` entries, the least recently used ones are evicted, and entries
+    older than ``ttl`` seconds are considered absent.
+
+    :param max_size: maximum number of entries
+    :param ttl: lifetime of an entry, in seconds. None for no expiry
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and self._ttl is not None:
+                if now > entry[0] + self._ttl:
+                    del self._entries[key]
+                    self.evictions = self.evictions + 1
+                    entry = None
+
+            if entry is None:
+                self.misses = self.misses + 1
+                return default
+
+            self.hits = self.hits + 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any = True) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+
+            # Least recently used entries are first: pop them while too many or
+            # expired
+            while self._entries:
+                oldest_time, _ = next(iter(self._entries.values()))
+                expired = self._ttl is not None and now > oldest_time + self._ttl
+                if len(self._entries) <= self._max_size and not expired:
+                    break
+                self._entries.popitem(last=False)
+                self.evictions = self.evictions + 1
+
+
 class Notifier:
-    def __init__(self):
-        self._last_msg_time = {}
-        self._pushed_msg = set()
+    """Base notifier. Messages are queued by ``push`` and sent by a background
+    worker over a pooled session, so pushing never waits on a network round
+    trip. The worker is started by the first push. Failed sends are retried, honoring the rate limits of the API up to
+    ``max_retry_after`` seconds.
+
+    :param timeout: HTTP timeout of a single send
+    :param max_attempts: number of send attempts before dropping a message
+    :param queue_size: maximum number of messages waiting to be sent
+    :param dedup_size: maximum number of messages remembered by
+        ``humble_push`` and ``push_once``
+    :param dedup_ttl: how long these messages are remembered, in seconds
+    """
+
+    max_retry_after = 60
+
+    def __init__(
+        self,
+        timeout: float = 5,
+        max_attempts: int = 3,
+        queue_size: int = 1000,
+        dedup_size: int = 1024,
+        dedup_ttl: Optional[float] = 7 * 24 * 3600,
+    ):
+        self._last_msg_time = DedupCache(dedup_size, dedup_ttl)
+        self._pushed_msg = DedupCache(dedup_size, dedup_ttl)
+
+        self._timeout = timeout
+        self._max_attempts = max_attempts
+        self._session: Optional[requests.Session] = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the sending worker, if not started yet."""
+        with self._worker_lock:
+            if self._worker is not None:
+                return
+            self._session = requests.Session()
+            self._session.mount("https://", HTTPAdapter(pool_maxsize=1))
+            self._worker = threading.Thread(
+                target=self._run, name=f"{__title__}-notifier", daemon=True
+            )
+            self._worker.start()
+
+    def push(self, msg):
+        logger.info(msg)
+        if self._closed:
+            # Only logged, e.g. when a closed notifier is still part of a group
+            return
+        self.start()
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            logger.error(f"Notification queue full, dropping: {msg}")
+
+    def send(self, msg) -> requests.Response:
+        raise NotImplementedError()
+
+    def retry_after(self, reply: requests.Response) -> float:
+        """Return the delay asked by a rate limited reply, in seconds."""
+        try:
+            return float(reply.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return 1
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every message pushed so far has been handled. Return
+        False if the timeout expired first.
+        """
+        if self._worker is None:
+            return True
+        start = time.monotonic()
+        flushed = threading.Event()
+        try:
+            self._queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+        if timeout is not None:
+            timeout = max(0, timeout - (time.monotonic() - start))
+        return flushed.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10) -> None:
+        self._closed = True
+        if self._worker is None or not self._worker.is_alive():
+            return
+        if not self.flush(timeout):
+            logger.error(f"Notifications still pending after {timeout}s")
+        self._queue.put(None)
+        self._worker.join(timeout)
+        self._session.close()
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            elif isinstance(msg, threading.Event):
+                msg.set()
+            else:
+                self._deliver(msg)
+
+    def _deliver(self, msg):
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                with metrics.span("notifier_send", notifier=type(self).__name__):
+                    r = self.send(msg)
+            except requests.RequestException as exc:
+                logger.warning(f"Notification failed (attempt {attempt}): {exc}")
+                delay = 2 ** (attempt - 1)
+            else:
+                if r.status_code == 429:
+                    # A single worker sends every message, never park it long
+                    delay = min(self.retry_after(r), self.max_retry_after)
+                    logger.warning(f"Notification rate limited for {delay}s")
+                elif r.status_code >= 500:
+                    delay = 2 ** (attempt - 1)
+                    logger.warning(f"Notification failed (HTTP {r.status_code})")
+                else:
+                    if r.status_code >= 400:
+                        logger.error(f"Notification refused (HTTP {r.status_code})")
+                    metrics.counter("notifications_total").inc(status=r.status_code)
+                    return
+
+            if attempt < self._max_attempts:
+                time.sleep(delay)
+
+        metrics.counter("notifications_total").inc(status="dropped")
+        logger.error(f"Notification dropped after {self._max_attempts} attempts")
+
+    @property
+    def dedup_stats(self) -> dict:
+        return {
+            "humble_push": self._last_msg_time.stats,
+            "push_once": self._pushed_msg.stats,
+        }
 
     def humble_push(self, msg, elapsed=60):
         now = time.time()
         last_time = self._last_msg_time.get(msg, 0)
         if now > last_time + elapsed:
             r = self.push(msg)
-            self._last_msg_time[msg] = now
+            self._last_msg_time.set(msg, now)
             return r
 
     def push_once(self, msg):
         if msg not in self._pushed_msg:
             r = self.push(msg)
-            self._pushed_msg.add(msg)
+            self._pushed_msg.set(msg)
             return r
 
 
@@ -40,15 +251,14 @@ class PushoverNotifier(Notifier):
         self._user = credentials["user"]
         self._token = credentials["token"]
 
-    def push(self, msg):
-        logger.info(msg)
+    def send(self, msg) -> requests.Response:
         data = {
             "token": self._token,
             "user": self._user,
             "message": msg,
             "priority": 1,
         }
-        r = requests.post(self.url, data=data)
+        r = self._session.post(self.url, data=data, timeout=self._timeout)
         return r
 
 
@@ -61,15 +271,51 @@ class DiscordNotifier(Notifier):
         self._token = credentials["token"]
         self.channel = credentials["channel"]
 
-    def push(self, msg):
-        logger.info(msg)
+    def send(self, msg) -> requests.Response:
         headers = {
             "User-Agent": "DiscordBot",
             "Content-Type": "application/json",
             "Authorization": f"Bot {self._token}",
         }
         data = {"content": msg}
-        r = requests.post(
-            self.url.format(self.channel), data=json.dumps(data), headers=headers
+        r = self._session.post(
+            self.url.format(self.channel),
+            data=json.dumps(data),
+            headers=headers,
+            timeout=self._timeout,
         )
         return r
+
+    def retry_after(self, reply: requests.Response) -> float:
+        # Prefer the headers, in seconds: the JSON body value is in
+        # milliseconds on the unversioned API routes
+        for header in ("Retry-After", "X-RateLimit-Reset-After"):
+            try:
+                return float(reply.headers[header])
+            except (KeyError, ValueError):
+                pass
+        try:
+            return float(reply.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            return super().retry_after(reply)
+
+
+class LogNotifier(Notifier):
+    """Only log the messages, for dry runs and benchmarks."""
+
+    def push(self, msg):
+        logger.info(msg)
+
+
+class NotifierGroup(Notifier):
+    """Push every message to a group of notifiers, e.g. to alert every buyer
+    of a multi-buyer process.
+    """
+
+    def __init__(self, notifiers: List[Notifier], **kwargs):
+        super().__init__(**kwargs)
+        self._notifiers = notifiers
+
+    def push(self, msg):
+        for notifier in self._notifiers:
+            notifier.push(msg)
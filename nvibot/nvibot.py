@@ -1,101 +1,237 @@
-# coding=utf-8
-
-import time
-import logging
-from typing import List
-
-from . import __title__
-from .notifiers import Notifier
-from .nvidia_api import NvidiaApiScrapper
-from .ldlc_driver import LdlcDriver, LdlcError
-
-logger = logging.getLogger(__title__)
-
-
-class Nvibot:
-    """A bot to watch the availability of Nvidia GPUs, and automatically buy
-    selected models.
-
-    At most, one copy of each category is bought.
-
-    :param ldlc_driver: the LDLC buying driver
-    :param nvidia_scrapper: the Nvidia API scrapper
-    :param notifier: used to push notifications
-    :param buy_priority: the list of selected GPU models
-    :param buy_limit: the maximum number of models to buy
-    """
-
-    def __init__(
-        self,
-        ldlc_driver: LdlcDriver,
-        nvidia_scrapper: NvidiaApiScrapper,
-        notifier: Notifier,
-        buy_priority: List[str],
-        buy_limit: int,
-    ):
-        self._notifier = notifier
-        self._ldlc_driver = ldlc_driver
-        self._nvidia_scrapper = nvidia_scrapper
-
-        self._buy_priority = buy_priority.copy()
-        self._buy_limit = buy_limit
-
-        self._bought = set()
-
-        self._alive_log_decimation = 10
-        self._error_stack_tolerance = 5
-
-    @property
-    def done(self) -> bool:
-        return len(self._bought) >= self._buy_limit
-
-    def run(self) -> None:
-        with self._ldlc_driver:
-            self._ldlc_driver.login()
-            self._notifier.push("Nvidia scrapping started")
-            self.lookup_and_buy()
-
-        self._notifier.push("My job is done !")
-
-    def lookup_and_buy(self) -> None:
-        alive_count = 0
-        successive_error_count = 0
-
-        while not self.done:
-            time.sleep(2)
-
-            if alive_count == 0:
-                logger.debug("I'm still alive !")
-            alive_count = (alive_count + 1) % self._alive_log_decimation
-
-            # Safe scrap
-            try:
-                urls_to_try = self._nvidia_scrapper.scrap()
-                successive_error_count = 0
-            except Exception as exc:
-                urls_to_try = {}
-                successive_error_count = successive_error_count + 1
-                logger.error(f"Scrapping error: {exc}")
-                if successive_error_count > self._error_stack_tolerance:
-                    self._notifier.humble_push(f"Errors are stacking: {exc}")
-                    successive_error_count = 0
-
-            for product in self._buy_priority:
-                if not self.done and product in urls_to_try:
-                    product_url = urls_to_try[product]
-                    self._notifier.push(
-                        f"Transaction attempt: {product} ({product_url})"
-                    )
-
-                    # Safely try to buy stuff
-                    try:
-                        self._ldlc_driver.buy(product_url)
-                    except LdlcError:
-                        pass
-                    else:
-                        self.consider_bought(product)
-
-    def consider_bought(self, product: str) -> None:
-        self._buy_priority.remove(product)
-        self._bought.add(product)
-        self._notifier.push(f"{product} considered bought !")
+# coding=utf-8
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Dict
+
+from . import __title__
+from . import metrics
+from .notifiers import Notifier
+from .nvidia_api import NvidiaApiScrapper
+from .retailer import RetailerDriver, RetailerError, PaymentOutcomeUnknown
+from .scheduler import PollScheduler, AdaptiveScheduler
+from .coordinator import BuyCoordinator
+
+logger = logging.getLogger(__title__)
+
+
+class Nvibot:
+    """A bot to watch the availability of Nvidia GPUs, and automatically buy
+    selected models.
+
+    At most, one copy of each category is bought.
+
+    Scrapping and buying are decoupled: the calling thread polls the Nvidia
+    API and queues the results, which buy workers consume. The shared
+    ``BuyCoordinator`` keeps the workers within the buy priority and limit,
+    and stock changes are still detected while a checkout is running.
+
+    :param ldlc_driver: the buying driver, e.g. an ``LdlcDriver``, an
+        ``LdlcDriverPool`` or a ``RetailerRace``
+    :param nvidia_scrapper: the Nvidia API scrapper
+    :param notifier: used to push notifications
+    :param buy_priority: the list of selected GPU models
+    :param buy_limit: the maximum number of models to buy
+    :param scheduler: decides the wait between two polls. Defaults to an
+        ``AdaptiveScheduler``
+    :param parallel: number of buy workers, i.e. maximum number of concurrent
+        transactions. Above 1, the LDLC driver must support concurrent ``buy``
+        calls, as an ``LdlcDriverPool`` does
+    """
+
+    def __init__(
+        self,
+        ldlc_driver: RetailerDriver,
+        nvidia_scrapper: NvidiaApiScrapper,
+        notifier: Notifier,
+        buy_priority: List[str],
+        buy_limit: int,
+        scheduler: Optional[PollScheduler] = None,
+        parallel: int = 1,
+    ):
+        self._notifier = notifier
+        self._ldlc_driver = ldlc_driver
+        self._nvidia_scrapper = nvidia_scrapper
+        self._scheduler = scheduler or AdaptiveScheduler()
+        self._nvidia_scrapper.subscribe(self._scheduler.on_stock_event)
+
+        self._coordinator = BuyCoordinator(buy_priority, buy_limit)
+        self._parallel = parallel
+
+        # At most one pending poll result per worker, the latest ones
+        self._stock_queue = queue.Queue(parallel)
+        self._stopping = threading.Event()
+
+        # Stock no slot was left for, while transactions were in flight
+        self._deferred: Dict[str, str] = {}
+        self._deferred_lock = threading.Lock()
+
+        self._alive_log_decimation = 10
+        self._error_stack_tolerance = 5
+
+    @property
+    def done(self) -> bool:
+        return self._coordinator.done
+
+    def run(self) -> None:
+        with self._ldlc_driver, ThreadPoolExecutor(
+            self._parallel, thread_name_prefix=f"{__title__}-buyer"
+        ) as executor:
+            self._ldlc_driver.ensure_logged_in()
+            self._notifier.push("Nvidia scrapping started")
+
+            self._stopping.clear()
+            workers = [executor.submit(self.buy_worker) for _ in range(self._parallel)]
+            try:
+                self.lookup(workers)
+            finally:
+                self.stop()
+            # Raise the error of a failed worker, if any
+            for worker in workers:
+                worker.result()
+
+        self._notifier.push("My job is done !")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        # Wake up the idle workers
+        for _ in range(self._parallel):
+            self.publish(None)
+
+    def lookup(self, workers: List[Future]) -> None:
+        """Poll the Nvidia API and publish the results to the buy workers,
+        until the buy limit is reached or a worker fails.
+        """
+        alive_count = 0
+        successive_error_count = 0
+
+        while not self.done and not any(worker.done() for worker in workers):
+            self._scheduler.wait()
+
+            if alive_count == 0:
+                logger.debug("I'm still alive !")
+            alive_count = (alive_count + 1) % self._alive_log_decimation
+
+            # Safe scrap
+            iteration_start = time.perf_counter()
+            self._scheduler.poll_started()
+            try:
+                urls_to_try = self._nvidia_scrapper.scrap()
+                successive_error_count = 0
+                self._scheduler.poll_succeeded()
+            except Exception as exc:
+                self._scheduler.poll_failed(exc)
+                successive_error_count = successive_error_count + 1
+                logger.error(f"Scrapping error: {exc}")
+                if successive_error_count > self._error_stack_tolerance:
+                    self._notifier.humble_push(f"Errors are stacking: {exc}")
+                    successive_error_count = 0
+            else:
+                self.publish(urls_to_try)
+
+            metrics.histogram("loop_iteration_seconds").observe(
+                time.perf_counter() - iteration_start
+            )
+
+    def publish(self, urls_to_try: Optional[Dict[str, str]]) -> None:
+        """Queue a poll result for the buy workers. When the queue is full,
+        the oldest result is merged into this one, the newest URL of a product
+        winning: a URL change is only reported on one poll, and must not be
+        lost.
+        """
+        while True:
+            try:
+                self._stock_queue.put_nowait(urls_to_try)
+                return
+            except queue.Full:
+                pass
+            try:
+                pending = self._stock_queue.get_nowait()
+            except queue.Empty:
+                continue
+            metrics.counter("stock_polls_merged_total").inc()
+            if pending is None or urls_to_try is None:
+                # Stopping wins
+                urls_to_try = None
+            else:
+                urls_to_try = {**pending, **urls_to_try}
+
+    def next_stock(self, block: bool = True) -> Optional[Dict[str, str]]:
+        """Return the queued poll results, merged, the newest URL of a product
+        winning. Return None when stopping, or when not blocking and nothing
+        is queued.
+        """
+        urls_to_try = None
+        try:
+            pending = self._stock_queue.get(block=block)
+            # None only wakes a worker up, stop draining on it
+            while pending is not None:
+                urls_to_try = {**(urls_to_try or {}), **pending}
+                pending = self._stock_queue.get_nowait()
+        except queue.Empty:
+            pass
+        return None if self._stopping.is_set() else urls_to_try
+
+    def buy_worker(self) -> None:
+        """Attempt transactions on the published stock, one at a time. The
+        coordinator assigns the products by priority across the workers.
+        """
+        while not self._stopping.is_set():
+            urls_to_try = self.next_stock()
+            while urls_to_try:
+                with self._deferred_lock:
+                    products = self._coordinator.reserve(urls_to_try, 1)
+                    if not products:
+                        # Retried when a transaction in flight fails
+                        self._deferred = {**self._deferred, **urls_to_try}
+                        break
+                product_url = urls_to_try.pop(products[0])
+                # Hand the other products over to the idle workers
+                if urls_to_try and self._parallel > 1:
+                    self.publish(urls_to_try)
+                    urls_to_try = {}
+
+                self.attempt(products[0], product_url)
+                if self.done:
+                    return
+
+                # A checkout takes a while, add the stock published meanwhile
+                fresh_urls = self.next_stock(block=False)
+                if fresh_urls is not None:
+                    urls_to_try = {**urls_to_try, **fresh_urls}
+
+    def attempt(self, product: str, product_url: str) -> None:
+        """Attempt a transaction on a product reserved in the coordinator."""
+        self._notifier.push(f"Transaction attempt: {product} ({product_url})")
+
+        # Safely try to buy stuff
+        try:
+            self._ldlc_driver.buy(product_url)
+        except PaymentOutcomeUnknown as exc:
+            # Never buy it again, the order may have gone through
+            self._notifier.push(f"{product} may be bought, check the orders: {exc}")
+            self.consider_bought(product)
+        except RetailerError:
+            self.release(product)
+        except:
+            self.release(product)
+            raise
+        else:
+            self.consider_bought(product)
+
+    def release(self, product: str) -> None:
+        """Release a failed product, and publish again the stock deferred
+        while its slot was held.
+        """
+        with self._deferred_lock:
+            self._coordinator.release(product)
+            deferred, self._deferred = self._deferred, {}
+        if deferred:
+            self.publish(deferred)
+
+    def consider_bought(self, product: str) -> None:
+        self._coordinator.commit(product)
+        self._notifier.push(f"{product} considered bought !")
@@ -1,138 +1,495 @@
-# coding=utf-8
-
-import os
-import time
-import logging
-import json
-from typing import Tuple, Dict
-
-import requests
-
-from . import __title__
-from .notifiers import Notifier
-
-logger = logging.getLogger(__title__)
-
-if os.name == "nt":
-    USER_AGENT = (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:90.0) Gecko/20100101 Firefox/90.0"
-    )
-else:
-    USER_AGENT = (
-        "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:90.0) Gecko/20100101 Firefox/90.0"
-    )
-
-
-class NvidiaApiError(Exception):
-    pass
-
-
-# https://api.store.nvidia.com/partner/v1/feinventory?skus=FR~NVGFT070~NVGFT080~NVGFT090~NVLKR30S~NSHRMT01~NVGFT060T~187&locale=FR
-
-
-class NvidiaApiScrapper:
-    """Scrap the Nvidia API to retrieve the URL of available Nvidia GPUs.
-
-    :param notifier: used to push notifications
-    :param timeout:
-    """
-
-    api_url = "https://api.store.nvidia.com/partner/v1/feinventory"
-    api_params = {
-        "skus": "FR~NVGFT070~NVGFT080~NVGFT090~NVLKR30S~NSHRMT01~NVGFT060T~187",
-        "locale": "FR",
-    }
-    api_headers = {
-        "user-agent": USER_AGENT,
-        "accept": "application/json, text/plain, */*",
-        "accept-language": "fr,fr-FR;q=0.8,en-US;q=0.5,en;q=0.3",
-        "accept-encoding": "gzip, deflate, br",
-        "cache-control": "max-age=0",
-        "host": "api.store.nvidia.com",
-        "origin": "https://shop.nvidia.com",
-        "referer": (
-            "https://shop.nvidia.com/fr-fr/geforce/store/gpu/?page=1&limit=100&locale=fr-fr&category=GPU&"
-            "gpu=RTX%203060%20Ti,RTX%203070,RTX%203070%20Ti,RTX%203080,RTX%203080%20Ti,RTX%203090&manufacturer=NVIDIA"
-        ),
-    }
-    sku_name_map = {
-        "NVGFT060T_FR": "3060Ti",
-        "NVGFT070_FR": "3070",
-        "NVGFT070T_FR": "3070Ti",
-        "NVGFT080_FR": "3080",
-        "NVGFT080T_FR": "3080Ti",
-        "NVGFT090_FR": "3090",
-    }
-
-    def __init__(self, notifier: Notifier, timeout: int):
-        self._notifier = notifier
-        self._current_fe_urls = {}
-        self._timeout = timeout
-
-    def scrap(self) -> Dict[str, str]:
-        """Return a dictionary of the available GPUs. Key are GPU name and
-        values are store URL.
-        """
-
-        timestamp = round(time.time())
-        params = self.api_params.copy()
-        params["timestamp"] = str(timestamp)
-        headers = self.api_headers.copy()
-        headers["referer"] = headers["referer"] + f"&timestamp={timestamp}"
-        reply = requests.get(
-            self.api_url,
-            params=params,
-            headers=headers,
-            timeout=self._timeout,
-        )
-
-        if reply.status_code != 200:
-            logger.error(f"HTTP {reply.status_code} - {reply.text}")
-            raise NvidiaApiError(f"HTTP {reply.status_code} - {reply.text}")
-
-        raw_data = reply.json()
-        return self.extract_available_gpu(raw_data)
-
-    def extract_available_gpu(self, raw_data: dict) -> Dict[str, str]:
-        try:
-            products = raw_data["listMap"]
-        except:
-            logger.error("NVIDIA API scrapping error: " + json.dumps(raw_data))
-            raise NvidiaApiError("raw data scrapping failed")
-
-        urls_to_try = {}
-
-        try:
-            for product in products:
-                fe_sku = product["fe_sku"]
-                if fe_sku in self.sku_name_map:
-                    gpu = self.sku_name_map[fe_sku]
-                    product_url, should_try = self.check_product(product, gpu)
-                    if should_try:
-                        urls_to_try[gpu] = product_url
-
-        except:
-            logger.error("NVIDIA API scrapping error: " + json.dumps(products))
-            raise NvidiaApiError("products scrapping failed")
-
-        return urls_to_try
-
-    def check_product(self, product: dict, gpu: str) -> Tuple[str, bool]:
-        should_try = False
-        availability = product["is_active"]
-        product_url = product["product_url"]
-
-        # Check if we observed an URL change
-        previous_url = self._current_fe_urls.get(gpu, product_url)
-        if product_url != previous_url:
-            self._notifier.push_once(f"New URL for {gpu}: {product_url}")
-            should_try = True
-
-        # Check if the is_active field is true
-        if availability.lower() == "true":
-            self._notifier.push_once(f"{gpu} in stock at {product_url} !")
-            should_try = True
-
-        self._current_fe_urls[gpu] = product_url
-
-        return product_url, should_try
+# coding=utf-8
+
+import os
+import time
+import queue
+import hashlib
+import logging
+import statistics
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Tuple, Dict, Optional, Callable, NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import __title__
+from . import jsonlib
+from . import metrics
+from .notifiers import Notifier
+
+logger = logging.getLogger(__title__)
+
+if os.name == "nt":
+    USER_AGENT = (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:90.0) Gecko/20100101 Firefox/90.0"
+    )
+else:
+    USER_AGENT = (
+        "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:90.0) Gecko/20100101 Firefox/90.0"
+    )
+
+
+class NvidiaApiError(Exception):
+    def __init__(self, msg: str = "", status_code: Optional[int] = None):
+        super().__init__(msg)
+        self.status_code = status_code
+
+
+class SkuState(NamedTuple):
+    """Last observed state of a Founders Edition SKU."""
+
+    product_url: str
+    is_active: bool
+
+
+# https://api.store.nvidia.com/partner/v1/feinventory?skus=FR~NVGFT070~NVGFT080~NVGFT090~NVLKR30S~NSHRMT01~NVGFT060T~187&locale=FR
+
+
+class NvidiaApiScrapper:
+    """Scrap the Nvidia API to retrieve the URL of available Nvidia GPUs.
+
+    The scrapper owns a pooled, keep-alive HTTP session so that successive
+    polls reuse the same TLS connection to the API.
+
+    :param notifier: used to push notifications
+    :param timeout: HTTP timeout of a single poll
+    :param preconnect: open the connection to the API at initialisation
+    :param api_params: API query overriding the default FR one
+    :param sku_name_map: SKU to GPU name map matching ``api_params``
+    :param hedge_percentile: enable hedged polls: when a poll is slower than
+        this percentile of the recent poll latencies, a second request is sent
+        over another connection and the first valid reply is used. None to
+        disable
+    """
+
+    max_idle_sessions = 2
+    hedge_min_samples = 20
+    hedge_min_delay = 0.05
+
+    api_url = "https://api.store.nvidia.com/partner/v1/feinventory"
+    api_params = {
+        "skus": "FR~NVGFT070~NVGFT080~NVGFT090~NVLKR30S~NSHRMT01~NVGFT060T~187",
+        "locale": "FR",
+    }
+    api_headers = {
+        "user-agent": USER_AGENT,
+        "accept": "application/json, text/plain, */*",
+        "accept-language": "fr,fr-FR;q=0.8,en-US;q=0.5,en;q=0.3",
+        "accept-encoding": "gzip, deflate, br",
+        "cache-control": "max-age=0",
+        "host": "api.store.nvidia.com",
+        "origin": "https://shop.nvidia.com",
+        "referer": (
+            "https://shop.nvidia.com/fr-fr/geforce/store/gpu/?page=1&limit=100&locale=fr-fr&category=GPU&"
+            "gpu=RTX%203060%20Ti,RTX%203070,RTX%203070%20Ti,RTX%203080,RTX%203080%20Ti,RTX%203090&manufacturer=NVIDIA"
+        ),
+    }
+    sku_name_map = {
+        "NVGFT060T_FR": "3060Ti",
+        "NVGFT070_FR": "3070",
+        "NVGFT070T_FR": "3070Ti",
+        "NVGFT080_FR": "3080",
+        "NVGFT080T_FR": "3080Ti",
+        "NVGFT090_FR": "3090",
+    }
+
+    def __init__(
+        self,
+        notifier: Notifier,
+        timeout: int,
+        preconnect: bool = False,
+        api_params: Optional[dict] = None,
+        sku_name_map: Optional[Dict[str, str]] = None,
+        hedge_percentile: Optional[float] = None,
+    ):
+        if api_params is not None:
+            self.api_params = api_params
+        if sku_name_map is not None:
+            self.sku_name_map = sku_name_map
+
+        self._notifier = notifier
+        self._sku_states = {}
+        self._timeout = timeout
+
+        self._etag = None
+        self._digest = None
+        self.unchanged_count = 0
+
+        self._listeners = []
+
+        # Idle sessions, the most recently used first. A request owns its
+        # session until it completes, so overlapping hedged requests never
+        # share one
+        self._sessions = queue.LifoQueue(self.max_idle_sessions)
+        self._stats_lock = threading.Lock()
+        self.poll_count = 0
+        self.reused_count = 0
+        self.reconnect_count = 0
+        self.last_latency = None
+
+        self._hedge_percentile = hedge_percentile
+        self._hedge_executor = None
+        self._latencies = deque(maxlen=200)
+        self.hedge_count = 0
+
+        if preconnect:
+            self.connect()
+
+    @classmethod
+    def locale_sku_name_map(cls, locale: str) -> Dict[str, str]:
+        """Return the SKU to GPU name map of a store locale. Apart from the
+        default one, GPU names are suffixed with the locale (e.g. "3080_DE").
+        """
+        default_locale = cls.api_params["locale"]
+        if locale == default_locale:
+            return cls.sku_name_map.copy()
+
+        return {
+            sku.replace(f"_{default_locale}", f"_{locale}"): f"{gpu}_{locale}"
+            for sku, gpu in cls.sku_name_map.items()
+        }
+
+    @classmethod
+    def for_locale(
+        cls, notifier: Notifier, timeout: int, locale: str, **kwargs
+    ) -> "NvidiaApiScrapper":
+        """Build a scrapper for another Nvidia store locale."""
+        default_locale = cls.api_params["locale"]
+        if locale == default_locale:
+            return cls(notifier, timeout, **kwargs)
+
+        api_params = {
+            "skus": locale + cls.api_params["skus"][len(default_locale) :],
+            "locale": locale,
+        }
+        return cls(
+            notifier,
+            timeout,
+            api_params=api_params,
+            sku_name_map=cls.locale_sku_name_map(locale),
+            **kwargs,
+        )
+
+    @property
+    def locale(self) -> str:
+        return self.api_params["locale"]
+
+    def subscribe(self, callback: Callable[[str, str, str], None]) -> None:
+        """Register a callback called with ``(event, gpu, product_url)`` on
+        SKU state transitions. Events are "new_url", "in_stock" and
+        "out_of_stock".
+        """
+        self._listeners.append(callback)
+
+    def emit(self, event: str, gpu: str, product_url: str) -> None:
+        for callback in self._listeners:
+            try:
+                callback(event, gpu, product_url)
+            except Exception as exc:
+                logger.exception(exc)
+
+    def new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        session.mount("https://", adapter)
+        session.headers["connection"] = "keep-alive"
+        return session
+
+    def checkout_session(self) -> requests.Session:
+        """Take an idle session, warm if possible, or open a new one."""
+        try:
+            return self._sessions.get_nowait()
+        except queue.Empty:
+            return self.new_session()
+
+    def checkin_session(self, session: requests.Session) -> None:
+        try:
+            self._sessions.put_nowait(session)
+        except queue.Full:
+            session.close()
+
+    def connect(self) -> None:
+        """(Re)open the HTTP session and establish the connection to the API
+        ahead of the first poll.
+        """
+        self.close()
+        session = self.new_session()
+        try:
+            session.head(self.api_url, headers=self.api_headers, timeout=self._timeout)
+        except requests.RequestException as exc:
+            logger.warning(f"Nvidia API pre-connection failed: {exc}")
+        self.checkin_session(session)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._sessions.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def connection_pool(self, session: requests.Session):
+        adapter = session.get_adapter(self.api_url)
+        return adapter.poolmanager.connection_from_url(self.api_url)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "polls": self.poll_count,
+            "reused": self.reused_count,
+            "reconnects": self.reconnect_count,
+            "unchanged": self.unchanged_count,
+            "last_latency": self.last_latency,
+            "hedges": self.hedge_count,
+        }
+
+    def request_args(self) -> dict:
+        """Return the arguments of a poll request, with a fresh timestamp. It is
+        in milliseconds, so that a hedged request does not repeat the query
+        string of the request it hedges.
+        """
+        timestamp = round(time.time() * 1000)
+        params = self.api_params.copy()
+        params["timestamp"] = str(timestamp)
+        headers = self.api_headers.copy()
+        headers["referer"] = headers["referer"] + f"&timestamp={timestamp}"
+        if self._etag is not None:
+            headers["if-none-match"] = self._etag
+        return {"params": params, "headers": headers, "timeout": self._timeout}
+
+    def fetch(self) -> requests.Response:
+        """Perform a single poll of the API, hedged if enabled and the latency
+        history allows it.
+        """
+        start = time.perf_counter()
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is None:
+            reply = self.fetch_primary()
+        else:
+            reply = self.fetch_hedged(hedge_delay)
+        self.last_latency = time.perf_counter() - start
+
+        return reply
+
+    def fetch_primary(self) -> requests.Response:
+        """Poll the API over a pooled session. A stale keep-alive connection
+        triggers one reconnection and a retry.
+        """
+        request_args = self.request_args()
+        session = self.checkout_session()
+        nb_connections = self.connection_pool(session).num_connections
+        start = time.perf_counter()
+        try:
+            try:
+                reply = session.get(self.api_url, **request_args)
+            except requests.ConnectionError as exc:
+                logger.warning(f"Stale Nvidia API connection, reconnecting: {exc}")
+                with self._stats_lock:
+                    self.reconnect_count = self.reconnect_count + 1
+                session.close()
+                session = self.new_session()
+                nb_connections = 0
+                reply = session.get(self.api_url, **request_args)
+        except Exception:
+            session.close()
+            raise
+        latency = time.perf_counter() - start
+        reused = self.connection_pool(session).num_connections == nb_connections
+        self.checkin_session(session)
+
+        with self._stats_lock:
+            self._latencies.append(latency)
+            self.poll_count = self.poll_count + 1
+            if reused:
+                self.reused_count = self.reused_count + 1
+        metrics.counter("scrap_connections_total").inc(reused=reused)
+        logger.debug(
+            f"Nvidia API poll took {latency * 1000:.0f} ms "
+            f"(connection reused: {reused}, "
+            f"{self.reused_count}/{self.poll_count} reused)"
+        )
+
+        return reply
+
+    def fetch_hedge(self) -> requests.Response:
+        """Poll the API over a pooled session, which is not the one of the
+        pending primary request. Its latency is not recorded.
+        """
+        session = self.checkout_session()
+        try:
+            reply = session.get(self.api_url, **self.request_args())
+        except Exception:
+            session.close()
+            raise
+        self.checkin_session(session)
+        return reply
+
+    def hedge_delay(self) -> Optional[float]:
+        """Return the delay after which a poll is hedged, None if it should
+        not be.
+        """
+        if self._hedge_percentile is None:
+            return None
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        with self._stats_lock:
+            latencies = list(self._latencies)
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        index = min(max(round(self._hedge_percentile), 1), 99) - 1
+        return max(cuts[index], self.hedge_min_delay)
+
+    def fetch_hedged(self, hedge_delay: float) -> requests.Response:
+        """Poll the API, and send a second request if no reply came within
+        ``hedge_delay``. The first valid reply is returned, and the other one
+        is discarded whenever it completes.
+        """
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=4, thread_name_prefix=f"{__title__}-hedge"
+            )
+
+        primary = self._hedge_executor.submit(self.fetch_primary)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        with self._stats_lock:
+            self.hedge_count = self.hedge_count + 1
+        metrics.counter("scrap_hedges_total").inc(outcome="sent")
+        hedge = self._hedge_executor.submit(self.fetch_hedge)
+
+        pending = {primary, hedge}
+        fallback = None
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    reply = future.result()
+                except requests.RequestException as exc:
+                    error = exc
+                    continue
+                if reply.status_code not in (200, 304):
+                    fallback = reply
+                    continue
+
+                winner = "hedge" if future is hedge else "primary"
+                metrics.counter("scrap_hedges_total").inc(outcome=f"{winner}_won")
+                for other in pending:
+                    other.add_done_callback(self.discard_reply)
+                return reply
+
+        if fallback is not None:
+            return fallback
+        raise error
+
+    @staticmethod
+    def discard_reply(future: Future) -> None:
+        if future.exception() is None:
+            future.result().close()
+
+    def scrap(self) -> Dict[str, str]:
+        """Return a dictionary of the available GPUs. Key are GPU name and
+        values are store URL.
+        """
+
+        with metrics.span("scrap", phase="network"):
+            reply = self.fetch()
+
+        if reply.status_code == 304:
+            self.unchanged_count = self.unchanged_count + 1
+            metrics.counter("scrap_polls_total").inc(result="unchanged")
+            return self.available_gpu()
+
+        if reply.status_code != 200:
+            metrics.counter("scrap_polls_total").inc(result="error")
+            summary = jsonlib.summarize(reply.content)
+            logger.error(f"HTTP {reply.status_code} - {summary}")
+            raise NvidiaApiError(
+                f"HTTP {reply.status_code} - {summary}", reply.status_code
+            )
+
+        with metrics.span("scrap", phase="parse"):
+            # Fast path: the inventory rarely changes, skip decoding identical
+            # bodies
+            digest = hashlib.blake2b(reply.content, digest_size=16).digest()
+            if digest == self._digest:
+                self.unchanged_count = self.unchanged_count + 1
+                metrics.counter("scrap_polls_total").inc(result="unchanged")
+                return self.available_gpu()
+
+            try:
+                raw_data = jsonlib.loads(reply.content)
+            except ValueError:
+                summary = jsonlib.summarize(reply.content)
+                logger.error(f"NVIDIA API decoding error: {summary}")
+                raise NvidiaApiError("raw data decoding failed")
+
+            urls_to_try = self.extract_available_gpu(raw_data)
+
+        metrics.counter("scrap_polls_total").inc(result="changed")
+
+        self._digest = digest
+        self._etag = reply.headers.get("etag")
+        return urls_to_try
+
+    def available_gpu(self) -> Dict[str, str]:
+        """Return the GPUs marked as active by the last decoded response."""
+        return {
+            gpu: state.product_url
+            for gpu, state in self._sku_states.items()
+            if state.is_active
+        }
+
+    def sku_state(self, gpu: str) -> Optional[SkuState]:
+        """Return the last observed state of a GPU, if any."""
+        return self._sku_states.get(gpu)
+
+    def extract_available_gpu(self, raw_data: dict) -> Dict[str, str]:
+        try:
+            products = raw_data["listMap"]
+        except:
+            logger.error("NVIDIA API scrapping error: " + jsonlib.summarize(raw_data))
+            raise NvidiaApiError("raw data scrapping failed")
+
+        urls_to_try = {}
+
+        try:
+            for product in products:
+                fe_sku = product["fe_sku"]
+                if fe_sku in self.sku_name_map:
+                    gpu = self.sku_name_map[fe_sku]
+                    product_url, should_try = self.check_product(product, gpu)
+                    if should_try:
+                        urls_to_try[gpu] = product_url
+
+        except:
+            logger.error("NVIDIA API scrapping error: " + jsonlib.summarize(products))
+            raise NvidiaApiError("products scrapping failed")
+
+        return urls_to_try
+
+    def check_product(self, product: dict, gpu: str) -> Tuple[str, bool]:
+        should_try = False
+        is_active = product["is_active"].lower() == "true"
+        product_url = product["product_url"]
+        previous = self._sku_states.get(gpu, SkuState(product_url, False))
+        # Stored first, so that event callbacks see the new state
+        self._sku_states[gpu] = SkuState(product_url, is_active)
+
+        # Check if we observed an URL change
+        if product_url != previous.product_url:
+            self._notifier.push_once(f"New URL for {gpu}: {product_url}")
+            self.emit("new_url", gpu, product_url)
+            should_try = True
+
+        # Check if the is_active field is true
+        if is_active:
+            self._notifier.push_once(f"{gpu} in stock at {product_url} !")
+            should_try = True
+
+        if is_active != previous.is_active:
+            self.emit("in_stock" if is_active else "out_of_stock", gpu, product_url)
+
+        return product_url, should_try
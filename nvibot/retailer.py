@@ -0,0 +1,263 @@
+# coding=utf-8
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from . import __title__
+from . import metrics
+from .notifiers import Notifier
+
+if TYPE_CHECKING:
+    from .deadline import Deadline
+
+logger = logging.getLogger(__title__)
+
+
+class RetailerError(Exception):
+    pass
+
+
+class RetailerAborted(RetailerError):
+    pass
+
+
+class PaymentOutcomeUnknown(RetailerError):
+    """The payment was submitted, but whether the order went through is
+    unknown. The transaction must not be retried: the product may be bought.
+    """
+
+
+class RetailerDriver:
+    """Base of the retailer buying drivers. A transaction runs in two steps:
+    ``reach_payment`` fills the basket up to the payment page, then ``pay``
+    places the order. ``cancel`` empties the basket instead.
+
+    A driver may be asked to ``abort`` its transaction from another thread;
+    it should then raise ``RetailerAborted`` at its next ``check_aborted``.
+
+    Both steps accept the ``Deadline`` of the transaction, so that a caller
+    running them separately keeps a single time budget.
+    """
+
+    url = ""
+
+    def __init__(self):
+        self.aborted = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+    @property
+    def name(self) -> str:
+        return self.site_netloc(self.url)
+
+    @staticmethod
+    def site_netloc(url: str) -> str:
+        netloc = urlparse(url).netloc
+        return netloc[4:] if netloc.startswith("www.") else netloc
+
+    def handles(self, url: str) -> bool:
+        return self.site_netloc(url) == self.name
+
+    def ensure_logged_in(self) -> None:
+        pass
+
+    def buy(self, url: str) -> None:
+        self.reach_payment(url)
+        self.pay()
+
+    def reach_payment(self, url: str, deadline: Optional["Deadline"] = None) -> None:
+        raise NotImplementedError()
+
+    def pay(self, deadline: Optional["Deadline"] = None) -> None:
+        raise NotImplementedError()
+
+    def cancel(self) -> None:
+        raise NotImplementedError()
+
+    def abort(self) -> None:
+        self.aborted.set()
+
+    def check_aborted(self) -> None:
+        if self.aborted.is_set():
+            raise RetailerAborted(f"{self.name} transaction aborted")
+
+
+class RetailerRace(RetailerDriver):
+    """Race the purchase of a product at several retailers. The attempts run
+    concurrently, the first one reaching the payment page wins and pays, and
+    the others are aborted and their baskets emptied. As only one order is
+    placed, the buy limit holds.
+
+    The URL given to ``buy`` goes to the driver handling its site. Alternate
+    URLs of the same product at other retailers are found from the product
+    name, which the race learns by subscribing to the scrapper events.
+
+    A race runs one transaction at a time, and its drivers are independent
+    browsers: a driver pool cannot be raced. Both steps of the transaction
+    share one time budget, across every raced driver. A failed payment empties
+    the basket of the winner, and when every attempt fails, every basket is
+    emptied.
+
+    :param drivers: the raced retailer drivers
+    :param notifier: used to push the race notifications
+    :param alternates: per product name, URLs of the product at other
+        retailers
+    :param transaction_budget: time budget of a transaction, in seconds. None
+        for no limit
+
+    Example:
+
+        >>> race = RetailerRace([ldlc, other], notifier, {"3080": [other_url]})
+            nvidia_scrapper.subscribe(race.on_stock_event)
+            with race:
+                race.ensure_logged_in()
+                race.buy(ldlc_url)
+    """
+
+    def __init__(
+        self,
+        drivers: List[RetailerDriver],
+        notifier: Notifier,
+        alternates: Optional[Dict[str, List[str]]] = None,
+        transaction_budget: Optional[float] = 600,
+    ):
+        super().__init__()
+        self._drivers = drivers
+        self._notifier = notifier
+        self._alternates = alternates or {}
+        self._transaction_budget = transaction_budget
+        self._products = {}
+        self._winner = None
+        self._deadline = None
+        self._executor = None
+        self._exit_stack = None
+
+    def __enter__(self):
+        with ExitStack() as exit_stack:
+            for driver in self._drivers:
+                exit_stack.enter_context(driver)
+            self._exit_stack = exit_stack.pop_all()
+        # Twice the drivers, so that clean ups never wait for a slot
+        self._executor = ThreadPoolExecutor(
+            2 * len(self._drivers), thread_name_prefix=f"{__title__}-race"
+        )
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self._executor.shutdown(wait=True)
+        return self._exit_stack.__exit__(*args, **kwargs)
+
+    @property
+    def name(self) -> str:
+        return "+".join(driver.name for driver in self._drivers)
+
+    def handles(self, url: str) -> bool:
+        return any(driver.handles(url) for driver in self._drivers)
+
+    def on_stock_event(self, event: str, gpu: str, product_url: str) -> None:
+        if event in ("new_url", "in_stock"):
+            self._products[product_url] = gpu
+
+    def ensure_logged_in(self) -> None:
+        futures = [
+            self._executor.submit(driver.ensure_logged_in) for driver in self._drivers
+        ]
+        for future in futures:
+            future.result()
+
+    def targets(self, url: str) -> List[Tuple[RetailerDriver, str]]:
+        """Return the raced drivers for a product URL, with their own URL."""
+        urls = [url] + self._alternates.get(self._products.get(url), [])
+        targets = []
+        for driver in self._drivers:
+            for target_url in urls:
+                if driver.handles(target_url):
+                    targets.append((driver, target_url))
+                    break
+        return targets
+
+    def reach_payment(self, url: str, deadline: Optional["Deadline"] = None) -> None:
+        # The deadline module depends on this one
+        from .deadline import Deadline
+
+        targets = self.targets(url)
+        if not targets:
+            raise RetailerError(f"No retailer handles {url}")
+
+        self._deadline = deadline or Deadline(self._transaction_budget)
+        for driver, _ in targets:
+            driver.aborted.clear()
+        futures = {
+            self._executor.submit(
+                driver.reach_payment, target_url, deadline=self._deadline
+            ): driver
+            for driver, target_url in targets
+        }
+
+        errors = {}
+        for future in as_completed(futures):
+            driver = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                logger.warning(f"Race attempt at {driver.name} failed: {exc}")
+                errors[driver.name] = exc
+                continue
+
+            self._winner = driver
+            break
+
+        if self._winner is None:
+            self._deadline = None
+            for future, driver in futures.items():
+                self._executor.submit(self.clean_up, driver, future)
+            # A failure that is not the retailer's is a bug, let it through
+            for error in errors.values():
+                if not isinstance(error, RetailerError):
+                    raise error
+            summary = ", ".join(f"{name}: {exc!r}" for name, exc in errors.items())
+            raise RetailerError(f"Every race attempt failed ({summary})") from error
+
+        logger.info(f"{self._winner.name} won the race to the payment")
+        metrics.counter("race_wins_total").inc(retailer=self._winner.name)
+        for future, driver in futures.items():
+            if driver is not self._winner:
+                driver.abort()
+                self._executor.submit(self.clean_up, driver, future)
+
+    def clean_up(self, driver: RetailerDriver, attempt: Future) -> None:
+        """Empty the basket of a losing driver, once its attempt is over."""
+        wait([attempt])
+        try:
+            driver.cancel()
+        except Exception as exc:
+            self._notifier.push(f"Basket clean up failed at {driver.name}: {exc}")
+
+    def pay(self, deadline: Optional["Deadline"] = None) -> None:
+        winner, self._winner = self._winner, None
+        deadline, self._deadline = deadline or self._deadline, None
+        self._notifier.push(f"Paying at {winner.name}")
+        try:
+            winner.pay(deadline=deadline)
+        except PaymentOutcomeUnknown:
+            # The order may be placed, leave the basket alone
+            raise
+        except Exception:
+            try:
+                winner.cancel()
+            except Exception as exc:
+                self._notifier.push(f"Basket clean up failed at {winner.name}: {exc}")
+            raise
+
+    def cancel(self) -> None:
+        winner, self._winner = self._winner, None
+        if winner is not None:
+            winner.cancel()
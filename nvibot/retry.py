@@ -0,0 +1,78 @@
+# coding=utf-8
+
+from typing import Dict, NamedTuple, Optional
+
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    TimeoutException,
+)
+
+CAT_PAGE = "cat_page"
+TIMEOUT = "timeout"
+STALE = "stale"
+OTHER = "other"
+
+
+class Attempt(NamedTuple):
+    """Record of a single attempt of a retried call."""
+
+    number: int
+    category: str
+    duration: float
+    delay: float
+
+
+class RetryPolicy:
+    """Describe how a failing call is retried. Failures are classified, and
+    each category has its own base delay, grown exponentially with the number
+    of attempts.
+
+    - "cat_page": LDLC served its maintenance page
+    - "timeout": a Selenium wait timed out
+    - "stale": the DOM moved under our feet, worth retrying at once
+    - "other": anything else
+
+    :param max_attempts: number of attempts before giving up
+    :param base_delays: base delay of each failure category, in seconds
+    :param factor: delay multiplier applied on each attempt
+    :param max_delay: maximum delay between two attempts, in seconds
+    :param deadline: overall time budget of the call, in seconds. None for no
+        limit
+    """
+
+    default_base_delays = {CAT_PAGE: 2, TIMEOUT: 0.5, STALE: 0, OTHER: 1}
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delays: Optional[Dict[str, float]] = None,
+        factor: float = 1.5,
+        max_delay: float = 10,
+        deadline: Optional[float] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delays = {**self.default_base_delays, **(base_delays or {})}
+        self.factor = factor
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def classify(self, exc: Exception, page_title: str) -> str:
+        if "maintenance" in page_title:
+            return CAT_PAGE
+        elif isinstance(exc, TimeoutException):
+            return TIMEOUT
+        elif isinstance(exc, StaleElementReferenceException):
+            return STALE
+        else:
+            return OTHER
+
+    def delay(self, category: str, attempt: int) -> float:
+        delay = self.base_delays[category] * self.factor ** (attempt - 1)
+        return min(delay, self.max_delay)
+
+    def should_retry(self, attempt: int, elapsed: float, delay: float) -> bool:
+        if attempt >= self.max_attempts:
+            return False
+        if self.deadline is not None and elapsed + delay > self.deadline:
+            return False
+        return True
@@ -0,0 +1,136 @@
+# coding=utf-8
+
+import time
+import random
+import logging
+
+import requests
+
+from . import __title__
+from .nvidia_api import NvidiaApiError
+
+logger = logging.getLogger(__title__)
+
+
+class PollScheduler:
+    """Decide how long the lookup loop waits between two polls. This base
+    scheduler always sleeps the same period, whatever happens.
+
+    :param period: time slept between two polls, in seconds
+    """
+
+    def __init__(self, period: float = 2):
+        self._period = period
+
+    def next_delay(self) -> float:
+        return self._period
+
+    def wait(self) -> None:
+        delay = self.next_delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def poll_started(self) -> None:
+        pass
+
+    def poll_succeeded(self) -> None:
+        pass
+
+    def poll_failed(self, exc: Exception) -> None:
+        pass
+
+    def burst(self) -> None:
+        pass
+
+    def on_stock_event(self, event: str, gpu: str, product_url: str) -> None:
+        """A scrapper event callback: a new URL usually means a drop is being
+        prepared, poll faster.
+        """
+        if event == "new_url":
+            self.burst()
+
+
+class AdaptiveScheduler(PollScheduler):
+    """A scheduler keeping the poll rate as high as the API tolerates.
+
+    - the time spent since the poll started is subtracted from the period
+    - HTTP errors and network errors trigger an exponential backoff, reset on
+      the first successful poll
+    - every delay is randomly jittered
+    - a burst of fast polls can be requested, e.g. after a "New URL" event
+
+    :param period: target poll period, in seconds
+    :param jitter: relative jitter applied to the period
+    :param backoff_factor: period multiplier applied on each successive error
+    :param max_backoff: maximum delay between two polls when backing off
+    :param burst_period: poll period during a burst, in seconds
+    :param burst_duration: duration of a burst, in seconds
+    """
+
+    backoff_statuses = {403, 429}
+
+    def __init__(
+        self,
+        period: float = 2,
+        jitter: float = 0.1,
+        backoff_factor: float = 2,
+        max_backoff: float = 120,
+        burst_period: float = 0.5,
+        burst_duration: float = 60,
+    ):
+        super().__init__(period)
+        self._jitter = jitter
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._burst_period = burst_period
+        self._burst_duration = burst_duration
+
+        self._backoff = 1
+        self._burst_until = 0
+        self._poll_start = None
+
+    @property
+    def bursting(self) -> bool:
+        return time.monotonic() < self._burst_until
+
+    def next_delay(self) -> float:
+        if self._backoff > 1:
+            period = min(self._period * self._backoff, self._max_backoff)
+        elif self.bursting:
+            period = self._burst_period
+        else:
+            period = self._period
+
+        period = period * random.uniform(1 - self._jitter, 1 + self._jitter)
+        if self._poll_start is not None:
+            period = period - (time.monotonic() - self._poll_start)
+
+        return max(period, 0)
+
+    def poll_started(self) -> None:
+        self._poll_start = time.monotonic()
+
+    def poll_succeeded(self) -> None:
+        if self._backoff > 1:
+            logger.info(f"Nvidia API is back, resuming a {self._period}s period")
+        self._backoff = 1
+
+    def poll_failed(self, exc: Exception) -> None:
+        if isinstance(exc, NvidiaApiError):
+            status_code = exc.status_code
+            should_backoff = status_code is not None and (
+                status_code in self.backoff_statuses or status_code >= 500
+            )
+        else:
+            should_backoff = isinstance(exc, requests.RequestException)
+
+        if should_backoff:
+            self._backoff = min(
+                self._backoff * self._backoff_factor, self._max_backoff / self._period
+            )
+            period = min(self._period * self._backoff, self._max_backoff)
+            logger.warning(f"Backing off: next polls every {period:.1f}s")
+
+    def burst(self) -> None:
+        logger.info(f"Polling burst for the next {self._burst_duration}s")
+        self._burst_until = time.monotonic() + self._burst_duration
@@ -1,51 +1,214 @@
-# coding=utf-8
-
-import os
-import json as json_module
-
-import requests
-import boto3
-
-from . import __title__
-
-
-class SecretManager:
-    def __init__(self, buyer: str):
-        self._buyer = buyer
-
-    def get(self, secret_name: str, json: bool = False) -> str:
-        secret = self.get_raw(secret_name)
-        if json:
-            secret = json_module.loads(secret)
-        return secret
-
-
-class AwsSecretManager(SecretManager):
-    def __init__(self, buyer: str, region_name: str):
-        super().__init__(buyer)
-        self._buyer = buyer
-        self._region_name = region_name
-
-    def get_raw(self, secret_name: str) -> str:
-        client = boto3.client("ssm", region_name=self._region_name)
-        param_name = f"{__title__}/{self._buyer}/{secret_name}"
-        param_reply = client.get_parameter(Name=param_name, WithDecryption=True)
-        return param_reply["Parameter"]["Value"]
-
-
-class EnvSecretManager(SecretManager):
-    def get_raw(self, secret_name: str) -> str:
-        param_name = f"{__title__}_{self._buyer}_{secret_name}".upper()
-        return os.environ[param_name]
-
-
-def get_manager(buyer: str) -> SecretManager:
-    try:
-        reply = requests.get(
-            "http://169.254.169.254/latest/dynamic/instance-identity/document",
-            timeout=1,
-        )
-        region = reply.json()["region"]
-        return AwsSecretManager(buyer, region)
-    except (requests.ConnectTimeout, requests.ConnectionError):
-        return EnvSecretManager(buyer)
+# coding=utf-8
+
+import os
+import time
+import logging
+import functools
+import threading
+import json as json_module
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from . import __title__
+
+logger = logging.getLogger(__title__)
+
+
+class SecretManager:
+    def __init__(self, buyer: str):
+        self._buyer = buyer
+
+    def get(self, secret_name: str, json: bool = False) -> str:
+        secret = self.get_raw(secret_name)
+        if json:
+            secret = json_module.loads(secret)
+        return secret
+
+
+class AwsSecretManager(SecretManager):
+    """Secrets stored as SSM parameters named ``nvibot/<buyer>/<secret>``.
+
+    The parameters of the buyer are fetched at once, through a single reused
+    client, and cached for ``ttl`` seconds. A secret missing from the batch is
+    fetched on its own.
+
+    :param buyer: the buyer name
+    :param region_name: AWS region, defaults to the boto3 configuration
+    :param ttl: how long the fetched parameters are cached, in seconds
+    """
+
+    def __init__(self, buyer: str, region_name: Optional[str] = None, ttl: float = 300):
+        super().__init__(buyer)
+        self._buyer = buyer
+        self._region_name = region_name
+        self._ttl = ttl
+        self._client = None
+        self._cache = {}
+        self._fetch_time = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Imported here, as boto3 takes a while to load
+            import boto3
+
+            self._client = boto3.client("ssm", region_name=self._region_name)
+        return self._client
+
+    def get_raw(self, secret_name: str) -> str:
+        from botocore.exceptions import ClientError
+
+        with self._lock:
+            if (
+                self._fetch_time is None
+                or time.monotonic() > self._fetch_time + self._ttl
+            ):
+                try:
+                    self.fetch_all()
+                except ClientError as exc:
+                    # e.g. no GetParametersByPath permission, fetch one by one
+                    logger.warning(f"Batched secret fetch failed: {exc}")
+                    self._fetch_time = time.monotonic()
+            if secret_name not in self._cache:
+                param_name = f"{__title__}/{self._buyer}/{secret_name}"
+                param_reply = self.client.get_parameter(
+                    Name=param_name, WithDecryption=True
+                )
+                self._cache[secret_name] = param_reply["Parameter"]["Value"]
+            return self._cache[secret_name]
+
+    def fetch_all(self) -> None:
+        """Fetch every parameter of the buyer, usually in one round trip."""
+        paginator = self.client.get_paginator("get_parameters_by_path")
+        pages = paginator.paginate(
+            Path=f"/{__title__}/{self._buyer}", WithDecryption=True
+        )
+        self._cache = {
+            param["Name"].rsplit("/", 1)[-1]: param["Value"]
+            for page in pages
+            for param in page["Parameters"]
+        }
+        self._fetch_time = time.monotonic()
+
+
+class StaticSecretManager(SecretManager):
+    """Serve secrets from a dictionary, for dry runs and benchmarks."""
+
+    def __init__(self, buyer: str, secrets: Dict[str, str]):
+        super().__init__(buyer)
+        self._secrets = secrets
+
+    def get_raw(self, secret_name: str) -> str:
+        return self._secrets[secret_name]
+
+
+class EnvSecretManager(SecretManager):
+    def get_raw(self, secret_name: str) -> str:
+        return os.environ[self.variable_name(secret_name)]
+
+    def variable_name(self, secret_name: str) -> str:
+        return f"{__title__}_{self._buyer}_{secret_name}".upper()
+
+    def has_secrets(self) -> bool:
+        prefix = self.variable_name("")
+        return any(name.startswith(prefix) for name in os.environ)
+
+
+BACKENDS = ("auto", "aws", "env")
+BACKEND_CACHE = os.path.join("~", ".cache", __title__, "secret_backend.json")
+# A negative detection may come from a transient probe failure, it expires
+ENV_BACKEND_TTL = 24 * 3600
+IMDS_URL = "http://169.254.169.254"
+
+
+def probe_aws_region() -> Optional[str]:
+    """Return the region of this EC2 instance, None off EC2. The metadata
+    endpoint is queried with an IMDSv2 token when one is granted.
+    """
+    headers = {}
+    try:
+        token = requests.put(
+            f"{IMDS_URL}/latest/api/token",
+            headers={"x-aws-ec2-metadata-token-ttl-seconds": "60"},
+            timeout=1,
+        )
+        if token.status_code == 200:
+            headers["x-aws-ec2-metadata-token"] = token.text
+        reply = requests.get(
+            f"{IMDS_URL}/latest/dynamic/instance-identity/document",
+            headers=headers,
+            timeout=1,
+        )
+    except requests.RequestException:
+        return None
+
+    if reply.status_code != 200:
+        logger.warning(f"EC2 metadata endpoint replied HTTP {reply.status_code}")
+        return None
+    try:
+        return reply.json()["region"]
+    except (ValueError, KeyError, TypeError) as exc:
+        logger.warning(f"Unexpected EC2 instance identity document: {exc}")
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def detect_backend(use_cache: bool = True) -> Tuple[str, Optional[str]]:
+    """Return the secret backend of this host, and its AWS region if any.
+
+    The probe of the EC2 metadata endpoint costs a timeout off AWS, so its
+    result is cached in a file for the next starts: forever for AWS, for
+    ``ENV_BACKEND_TTL`` otherwise.
+
+    :param use_cache: False to probe again, ignoring the cached result
+    """
+    cache_path = os.path.expanduser(BACKEND_CACHE)
+    if use_cache:
+        try:
+            with open(cache_path) as cache_file:
+                cached = json_module.load(cache_file)
+            if (
+                cached["backend"] == "aws"
+                or time.time() - cached.get("time", 0) < ENV_BACKEND_TTL
+            ):
+                return cached["backend"], cached.get("region")
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    region = probe_aws_region()
+    backend = "env" if region is None else "aws"
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as cache_file:
+            json_module.dump(
+                {"backend": backend, "region": region, "time": time.time()},
+                cache_file,
+            )
+    except OSError as exc:
+        logger.warning(f"Secret backend not cached: {exc}")
+    return backend, region
+
+
+def get_manager(buyer: str, backend: Optional[str] = None) -> SecretManager:
+    """Return the secret manager of a buyer.
+
+    :param buyer: the buyer name
+    :param backend: "aws", "env", or "auto" to detect it. Defaults to the
+        ``NVIBOT_SECRETS`` environment variable, then to "auto"
+    """
+    backend = backend or os.environ.get(f"{__title__}_secrets".upper(), "auto")
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown secret backend {backend}, choose from {BACKENDS}")
+
+    region = None
+    if backend == "auto":
+        backend, region = detect_backend()
+        if backend == "env" and not EnvSecretManager(buyer).has_secrets():
+            # No secret in the environment: the detection may be wrong
+            backend, region = detect_backend(use_cache=False)
+    if backend == "aws":
+        return AwsSecretManager(buyer, region)
+    return EnvSecretManager(buyer)
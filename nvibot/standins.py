@@ -0,0 +1,358 @@
+# coding=utf-8
+
+"""Local stand-ins of the sites the bot talks to, to exercise it without
+touching the live sites.
+"""
+
+import time
+import hashlib
+import logging
+import threading
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from . import __title__
+from . import jsonlib
+from .ldlc_http import LdlcHttpCheckout
+from .nvidia_api import NvidiaApiScrapper
+
+logger = logging.getLogger(__title__)
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    form: Dict[str, list]
+    headers: Dict[str, str]
+    cookies: Dict[str, str]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        length = int(self.headers.get("content-length", 0))
+        form = parse_qs(self.rfile.read(length).decode()) if length else {}
+        cookies = SimpleCookie(self.headers.get("cookie", ""))
+        request = Request(
+            method,
+            url.path,
+            form,
+            {name.lower(): value for name, value in self.headers.items()},
+            {name: morsel.value for name, morsel in cookies.items()},
+        )
+        status, headers, body = self.server.standin.handle(request)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.__class__.__name__}: {format % args}")
+
+
+Reply = Tuple[int, Dict[str, str], bytes]
+
+
+class StandInServer:
+    """Base of the stand-in sites: an HTTP server on a local port, served from
+    a background thread. Subclasses implement ``handle``.
+
+    :param port: the listened port, 0 for a free one
+    """
+
+    def __init__(self, port: int = 0):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), StandInHandler)
+        self._httpd.standin = self
+        self._thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        port = self._httpd.server_address[1]
+        return f"http://localhost:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name=f"{__title__}-standin", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def handle(self, request: Request) -> Reply:
+        raise NotImplementedError()
+
+    @staticmethod
+    def json(data, status: int = 200) -> Reply:
+        return (
+            status,
+            {"content-type": "application/json"},
+            jsonlib.dumps(data).encode(),
+        )
+
+    @staticmethod
+    def html(body: str, status: int = 200) -> Reply:
+        page = (
+            "<!DOCTYPE html><html><head><title>LDLC</title></head>"
+            f"<body>{body}</body></html>"
+        )
+        return status, {"content-type": "text/html; charset=utf-8"}, page.encode()
+
+    @staticmethod
+    def redirect(location: str, headers: Optional[Dict[str, str]] = None) -> Reply:
+        return 302, {"location": location, **(headers or {})}, b""
+
+
+class NvidiaStandIn(StandInServer):
+    """A local stand-in of the Nvidia ``feinventory`` endpoint. SKU states are
+    flipped at once or on a schedule, and the flip times are recorded to
+    measure the detection latency. Replies carry an ETag, and If-None-Match is
+    honoured as the live API does.
+
+    :param port: the listened port, 0 for a free one
+    :param sku_name_map: the served SKUs, defaults to the scrapper ones
+    """
+
+    api_path = urlparse(NvidiaApiScrapper.api_url).path
+
+    def __init__(self, port: int = 0, sku_name_map: Optional[dict] = None):
+        super().__init__(port)
+        sku_name_map = sku_name_map or NvidiaApiScrapper.sku_name_map
+        self.skus = {
+            fe_sku: {"is_active": "false", "product_url": ""} for fe_sku in sku_name_map
+        }
+        self.flip_times = {}
+        self.request_count = 0
+
+    @property
+    def api_url(self) -> str:
+        return self.url + self.api_path
+
+    def flip(
+        self, fe_sku: str, is_active: bool, product_url: Optional[str] = None
+    ) -> None:
+        with self.lock:
+            self.skus[fe_sku]["is_active"] = "true" if is_active else "false"
+            if product_url is not None:
+                self.skus[fe_sku]["product_url"] = product_url
+            self.flip_times[fe_sku] = time.perf_counter()
+
+    def schedule(
+        self,
+        delay: float,
+        fe_sku: str,
+        is_active: bool,
+        product_url: Optional[str] = None,
+    ) -> threading.Timer:
+        """Flip a SKU after ``delay`` seconds."""
+        timer = threading.Timer(delay, self.flip, (fe_sku, is_active, product_url))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def handle(self, request: Request) -> Reply:
+        if request.path != self.api_path:
+            return self.json({"success": False}, 404)
+
+        with self.lock:
+            self.request_count += 1
+            list_map = [
+                {"fe_sku": fe_sku, "locale": "FR", **state}
+                for fe_sku, state in self.skus.items()
+            ]
+        status, headers, body = self.json({"success": True, "listMap": list_map})
+
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        if request.headers.get("if-none-match") == etag:
+            return 304, {"etag": etag}, b""
+        return status, {**headers, "etag": etag}, body
+
+
+class LdlcStandIn(StandInServer):
+    """A local stand-in of the LDLC site for a single customer, with the pages
+    and element ids the LDLC driver relies on: cookie consent, login, basket,
+    product pages with one click checkout, delivery and payment. It also
+    serves the HTTP fast path endpoints of ``LdlcHttpCheckout``.
+
+    The times of cart additions and orders are recorded to measure the
+    purchase latencies.
+
+    :param port: the listened port, 0 for a free one
+    """
+
+    auth_cookie = "standin_auth"
+    delivery_path = "/commande/livraison"
+    order_path = "/commande/paiement"
+
+    def __init__(self, port: int = 0):
+        super().__init__(port)
+        self.products = {}
+        self.basket = []
+        self.delivery_mode = None
+        self.cart_times = []
+        self.order_times = []
+
+    def product_url(self, product_id: str) -> str:
+        return f"{self.url}/fiche/{product_id}.html"
+
+    def set_available(self, product_id: str, available: bool = True) -> None:
+        with self.lock:
+            self.products[product_id] = available
+
+    def handle(self, request: Request) -> Reply:
+        method, path = request.method, request.path
+        cart_add_prefix = LdlcHttpCheckout.cart_add_path.split("{")[0]
+
+        if method == "POST" and path.startswith(cart_add_prefix):
+            return self.cart_add(path[len(cart_add_prefix) :])
+        elif method == "POST" and path == LdlcHttpCheckout.delivery_path:
+            return self.select_delivery(request.form)
+        elif path == LdlcHttpCheckout.payment_path:
+            return self.payment(request)
+        elif path == "/":
+            return self.page("<h1>LDLC</h1>", request)
+        elif path == "/connexion":
+            return self.login(request)
+        elif path.startswith("/fiche/") and path.endswith(".html"):
+            return self.product(path[len("/fiche/") : -len(".html")], request)
+        elif method == "POST" and path.startswith("/panier/oneclick/"):
+            return self.one_click(path[len("/panier/oneclick/") :])
+        elif path == self.delivery_path:
+            return self.delivery(request)
+        elif method == "POST" and path == self.order_path:
+            return self.order()
+        elif path == "/commande/confirmation":
+            return self.page("<h1>Merci</h1>", request)
+        elif path.startswith("/panier"):
+            return self.basket_page(path, request)
+        return self.page("<div class='p404'></div>", request, 404)
+
+    def page(self, body: str, request: Request, status: int = 200) -> Reply:
+        """Wrap a page body with the site header: cookie consent, account and
+        basket badge.
+        """
+        header = ""
+        if "cookiespreferences" not in request.cookies:
+            header += (
+                "<button id='cookieConsentAcceptButton' onclick=\""
+                "document.cookie='cookiespreferences=1; path=/'; this.remove();\">"
+                "Accepter</button>"
+            )
+        if self.auth_cookie in request.cookies:
+            header += "<a class='logout' href='/'>Deconnexion</a>"
+        else:
+            header += "<a id='compte' href='/connexion'>Compte</a>"
+        badge = f"<span class='nb-pdt'>{len(self.basket)}</span>" if self.basket else ""
+        header += f"<a id='panier' href='/panier'>Panier{badge}</a>"
+        return self.html(f"<header>{header}</header>{body}", status)
+
+    def login(self, request: Request) -> Reply:
+        if request.method == "POST":
+            return self.redirect("/", {"set-cookie": f"{self.auth_cookie}=1; Path=/"})
+        return self.page(
+            "<form method='post' action='/connexion'>"
+            "<input type='checkbox' id='LongAuthenticationDuration'>"
+            "<input id='Email' name='Email'>"
+            "<input id='Password' name='Password' type='password'>"
+            "<button type='submit'>Connexion</button>"
+            "</form>",
+            request,
+        )
+
+    def product(self, product_id: str, request: Request) -> Reply:
+        with self.lock:
+            available = self.products.get(product_id)
+        if available is None:
+            return self.page("<div class='p404'></div>", request, 404)
+        elif not available:
+            return self.page("<div class='p410'></div>", request, 410)
+        return self.page(
+            "<div id='modal-default' style='display:none'></div>"
+            "<div id='error-generic-modal' style='display:none'></div>"
+            f"<form method='post' action='/panier/oneclick/{product_id}'>"
+            "<input type='hidden' name='quantity' value='1'>"
+            "<button class='add-to-cart-oneclic' type='submit'>Acheter</button>"
+            "</form>",
+            request,
+        )
+
+    def cart_add(self, product_id: str) -> Reply:
+        with self.lock:
+            if not self.products.get(product_id):
+                return self.html("<div class='p410'></div>", 410)
+            self.basket.append(product_id)
+            self.cart_times.append(time.perf_counter())
+        return self.json({"success": True})
+
+    def one_click(self, product_id: str) -> Reply:
+        status, _, _ = self.cart_add(product_id)
+        if status != 200:
+            return self.redirect(f"/fiche/{product_id}.html")
+        return self.redirect(self.delivery_path)
+
+    def select_delivery(self, form: dict) -> Reply:
+        self.delivery_mode = form.get("SelectedDeliveryModeId", [None])[0]
+        return self.redirect(LdlcHttpCheckout.payment_path)
+
+    def delivery(self, request: Request) -> Reply:
+        if not self.basket:
+            return self.redirect("/")
+        return self.page(
+            "<div><input type='radio' name='SelectedDeliveryModeId' "
+            "id='SelectedDeliveryModeId370008' value='370008' checked></div>"
+            + self.payment_form(),
+            request,
+        )
+
+    def payment(self, request: Request) -> Reply:
+        if not self.basket:
+            return self.redirect("/")
+        return self.page(self.payment_form(), request)
+
+    def payment_form(self) -> str:
+        return (
+            f"<form id='payment-form' method='post' action='{self.order_path}'>"
+            "<input id='CardNumber'><input id='ExpirationDate'>"
+            "<input id='OwnerName'><input id='Cryptogram'>"
+            "<button class='maxi' type='submit'>Payer</button>"
+            "</form>"
+        )
+
+    def order(self) -> Reply:
+        with self.lock:
+            self.basket.clear()
+            self.order_times.append(time.perf_counter())
+        return self.redirect("/commande/confirmation")
+
+    def basket_page(self, path: str, request: Request) -> Reply:
+        if path == "/panier/vider/oui":
+            with self.lock:
+                self.basket.clear()
+            return self.redirect("/")
+        elif path == "/panier/vider":
+            return self.page(
+                "<span class='icon-trash'></span><a href='/panier/vider/oui'>OUI</a>",
+                request,
+            )
+        return self.page(
+            "<a href='/panier/vider'><span class='icon-trash'></span></a>", request
+        )
@@ -0,0 +1,143 @@
+# coding=utf-8
+
+"""Watch-only mode: scrap the Nvidia API and push notifications, without
+starting a browser. Only the light dependencies are imported, so it runs
+cheaply on small instances.
+
+Example:
+
+    $ python -m nvibot.watch buyer --locales FR DE
+"""
+
+import os
+import time
+import argparse
+import logging
+from typing import Optional, Tuple
+
+from . import __title__
+from . import secrets
+from . import cli
+from .notifiers import Notifier
+from .nvidia_api import NvidiaApiScrapper
+from .scheduler import PollScheduler, AdaptiveScheduler
+from .browser_watchdog import process_stat
+
+try:
+    import resource
+except ImportError:
+    # Unix only
+    resource = None
+
+logger = logging.getLogger(__title__)
+
+_import_time = time.perf_counter()
+
+
+def process_uptime() -> float:
+    """Return the time elapsed since the process started, in seconds. Off
+    Linux, it is measured from the import of this module.
+    """
+    try:
+        fields = process_stat()
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return time.perf_counter() - _import_time
+
+
+def memory_usage() -> Tuple[float, float]:
+    """Return the current and peak resident set sizes, in MiB, 0 if unknown."""
+    peak = 0.0
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    current = peak
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return current, max(current, peak)
+
+
+class Watcher:
+    """Poll the Nvidia API forever. The scrapper pushes the stock
+    notifications.
+
+    :param nvidia_scrapper: the Nvidia API scrapper
+    :param notifier: used to push notifications
+    :param scheduler: decides the wait between two polls. Defaults to an
+        ``AdaptiveScheduler``
+    """
+
+    def __init__(
+        self,
+        nvidia_scrapper: NvidiaApiScrapper,
+        notifier: Notifier,
+        scheduler: Optional[PollScheduler] = None,
+    ):
+        self._nvidia_scrapper = nvidia_scrapper
+        self._notifier = notifier
+        self._scheduler = scheduler or AdaptiveScheduler()
+        self._nvidia_scrapper.subscribe(self.on_stock_event)
+
+        self._error_stack_tolerance = 5
+
+    def run(self) -> None:
+        successive_error_count = 0
+
+        while True:
+            self._scheduler.wait()
+
+            self._scheduler.poll_started()
+            try:
+                self._nvidia_scrapper.scrap()
+                successive_error_count = 0
+                self._scheduler.poll_succeeded()
+            except Exception as exc:
+                self._scheduler.poll_failed(exc)
+                successive_error_count = successive_error_count + 1
+                logger.error(f"Scrapping error: {exc}")
+                if successive_error_count > self._error_stack_tolerance:
+                    self._notifier.humble_push(f"Errors are stacking: {exc}")
+                    successive_error_count = 0
+
+    def on_stock_event(self, event: str, gpu: str, product_url: str) -> None:
+        self._scheduler.on_stock_event(event, gpu, product_url)
+        if event == "out_of_stock":
+            self._notifier.push(f"{gpu} out of stock")
+
+
+def run_watch():
+    parser = argparse.ArgumentParser(f"{__title__}.watch")
+    parser.add_argument("buyer")
+    cli.add_common_arguments(parser)
+
+    args = parser.parse_args()
+    cli.setup(args)
+
+    secret_manager = secrets.get_manager(args.buyer, args.secrets)
+    notifier = cli.build_notifier(args, secret_manager)
+    nvidia_scrapper = cli.build_scrapper(args, notifier)
+    watcher = Watcher(nvidia_scrapper, notifier, AdaptiveScheduler(args.period))
+
+    rss, peak_rss = memory_usage()
+    notifier.push(
+        f"{__title__} watching {', '.join(args.locales)}: started in "
+        f"{process_uptime():.2f}s, RSS {rss:.1f} MiB (peak {peak_rss:.1f} MiB)"
+    )
+
+    try:
+        watcher.run()
+    except Exception as exc:
+        notifier.push(f"{__title__} exited with error: {exc}")
+        raise
+    finally:
+        notifier.close()
+
+
+if __name__ == "__main__":
+    run_watch()
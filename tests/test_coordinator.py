@@ -0,0 +1,83 @@
+# coding=utf-8
+
+import threading
+
+from nvibot.coordinator import BuyCoordinator
+
+
+def test_reserve_by_priority():
+    coordinator = BuyCoordinator(["3090", "3080", "3070"], 2)
+    assert coordinator.reserve(["3070", "3090", "3080"]) == ["3090", "3080"]
+    # Every slot is in flight
+    assert coordinator.reserve(["3070"]) == []
+
+    coordinator.release("3090")
+    assert coordinator.reserve(["3070", "3090"], 1) == ["3090"]
+
+
+def test_commit():
+    coordinator = BuyCoordinator(["3090", "3080"], 2)
+    assert coordinator.reserve(["3090"]) == ["3090"]
+    coordinator.commit("3090")
+    assert not coordinator.done
+    assert coordinator.buy_priority == ["3080"]
+    # A bought product is never reserved again
+    assert coordinator.reserve(["3090", "3080"]) == ["3080"]
+    coordinator.commit("3080")
+    assert coordinator.done
+    assert coordinator.reserve(["3090", "3080"]) == []
+
+
+def test_concurrent_reserve_release():
+    products = ["3090", "3080", "3070", "3060Ti"]
+    buy_limit = 2
+    coordinator = BuyCoordinator(products, buy_limit)
+    lock = threading.Lock()
+    in_flight = []
+    overbooked = []
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        for _ in range(2000):
+            reserved = coordinator.reserve(products, 1)
+            with lock:
+                in_flight.extend(reserved)
+                if len(in_flight) > buy_limit or len(set(in_flight)) < len(in_flight):
+                    overbooked.append(list(in_flight))
+            for product in reserved:
+                with lock:
+                    in_flight.remove(product)
+                coordinator.release(product)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overbooked == []
+    # Every slot is free again
+    assert coordinator.reserve(products) == products[:buy_limit]
+
+
+def test_concurrent_commit():
+    products = ["3090", "3080", "3070", "3060Ti"]
+    coordinator = BuyCoordinator(products, 2)
+    bought = []
+    lock = threading.Lock()
+
+    def worker():
+        while not coordinator.done:
+            for product in coordinator.reserve(products, 1):
+                with lock:
+                    bought.append(product)
+                coordinator.commit(product)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(bought) == ["3080", "3090"]
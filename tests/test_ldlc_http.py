@@ -0,0 +1,103 @@
+# coding=utf-8
+
+from unittest import mock
+
+import pytest
+
+from nvibot.ldlc_driver import LdlcDriver, UrlNotAvailable
+from nvibot.ldlc_http import LdlcHttpCheckout, FastPathError, FastPathUnavailable
+from nvibot.notifiers import LogNotifier
+from nvibot.secrets import StaticSecretManager
+from nvibot.standins import LdlcStandIn
+
+PRODUCT_ID = "AR202011090001"
+
+
+@pytest.fixture
+def standin():
+    with LdlcStandIn() as standin:
+        yield standin
+
+
+@pytest.fixture
+def ldlc(standin):
+    """An LDLC driver on the stand-in, over a fake browser: only the HTTP fast
+    path talks to the stand-in.
+    """
+    secret_manager = StaticSecretManager(
+        "buyer", {"ldlc": '{"user": "user", "password": "password"}', "cc": "{}"}
+    )
+    driver = LdlcDriver(
+        LogNotifier(), secret_manager, base_url=standin.url, http_checkout=True
+    )
+    driver._driver = mock.Mock()
+    driver._driver.get_cookies.return_value = [
+        {"name": LdlcStandIn.auth_cookie, "value": "1", "domain": "localhost"}
+    ]
+    driver._driver.execute_script.return_value = "Mozilla/5.0"
+    driver._basket_filled = False
+    with mock.patch.object(driver, "empty_basket"):
+        yield driver
+
+
+def test_checkout(standin):
+    standin.set_available(PRODUCT_ID)
+    checkout = LdlcHttpCheckout(standin.url, 2)
+    checkout.add_to_cart(standin.product_url(PRODUCT_ID))
+    checkout.select_delivery("370008")
+
+    assert standin.basket == [PRODUCT_ID]
+    assert standin.delivery_mode == "370008"
+
+
+@pytest.mark.parametrize("available", [False, None])
+def test_checkout_unavailable(standin, available):
+    if available is not None:
+        standin.set_available(PRODUCT_ID, available)
+    checkout = LdlcHttpCheckout(standin.url, 2)
+    with pytest.raises(FastPathUnavailable):
+        checkout.add_to_cart(standin.product_url(PRODUCT_ID))
+    assert standin.basket == []
+
+
+def test_checkout_unknown_url(standin):
+    checkout = LdlcHttpCheckout(standin.url, 2)
+    with pytest.raises(FastPathError):
+        checkout.add_to_cart(f"{standin.url}/produit.html")
+
+
+def test_fast_checkout(standin, ldlc):
+    standin.set_available(PRODUCT_ID)
+    assert ldlc.fast_checkout(standin.product_url(PRODUCT_ID))
+
+    assert standin.basket == [PRODUCT_ID]
+    ldlc._driver.get.assert_called_once_with(
+        standin.url + LdlcHttpCheckout.payment_path
+    )
+    assert ldlc._basket_filled
+    ldlc.empty_basket.assert_not_called()
+
+
+def test_fast_checkout_gone(standin, ldlc):
+    standin.set_available(PRODUCT_ID, False)
+    with pytest.raises(UrlNotAvailable):
+        ldlc.fast_checkout(standin.product_url(PRODUCT_ID))
+
+    assert standin.basket == []
+    assert not ldlc._basket_filled
+    ldlc._driver.get.assert_not_called()
+
+
+def test_fast_checkout_fallback_before_add(standin, ldlc):
+    # No product id in the URL: the browser flow takes over, nothing to empty
+    assert not ldlc.fast_checkout(f"{standin.url}/produit.html")
+    assert not ldlc._basket_filled
+    ldlc.empty_basket.assert_not_called()
+
+
+def test_fast_checkout_fallback_after_add(standin, ldlc):
+    standin.set_available(PRODUCT_ID)
+    ldlc._driver.find_element.side_effect = Exception("No payment form")
+
+    assert not ldlc.fast_checkout(standin.product_url(PRODUCT_ID))
+    ldlc.empty_basket.assert_called_once_with()
@@ -0,0 +1,124 @@
+# coding=utf-8
+
+import time
+
+import pytest
+
+from nvibot.notifiers import LogNotifier
+from nvibot.retailer import (
+    RetailerDriver,
+    RetailerError,
+    RetailerRace,
+    PaymentOutcomeUnknown,
+)
+
+PRODUCT = "3080"
+
+
+class FakeDriver(RetailerDriver):
+    """A retailer reaching the payment page after ``delay`` seconds, or failing
+    with ``error``.
+    """
+
+    def __init__(self, url, delay=0, error=None, pay_error=None):
+        super().__init__()
+        self.url = url
+        self.delay = delay
+        self.error = error
+        self.pay_error = pay_error
+        self.deadlines = []
+        self.paid = 0
+        self.cancelled = 0
+
+    def reach_payment(self, url, deadline=None):
+        self.deadlines.append(deadline)
+        time.sleep(self.delay)
+        self.check_aborted()
+        if self.error is not None:
+            raise self.error
+
+    def pay(self, deadline=None):
+        self.deadlines.append(deadline)
+        if self.pay_error is not None:
+            raise self.pay_error
+        self.paid += 1
+
+    def cancel(self):
+        self.cancelled += 1
+
+
+def race(*drivers):
+    race = RetailerRace(
+        list(drivers),
+        LogNotifier(),
+        {PRODUCT: [driver.url + "/p" for driver in drivers[1:]]},
+    )
+    race.on_stock_event("new_url", PRODUCT, drivers[0].url + "/p")
+    return race
+
+
+def test_winner_pays_losers_cancel():
+    fast = FakeDriver("https://www.fast.com")
+    slow = FakeDriver("https://www.slow.com", delay=0.2)
+    with race(slow, fast) as retailer_race:
+        retailer_race.buy(slow.url + "/p")
+
+    assert fast.paid == 1 and fast.cancelled == 0
+    assert slow.paid == 0 and slow.cancelled == 1
+    assert slow.aborted.is_set()
+    # One time budget across the race
+    assert fast.deadlines[0] is fast.deadlines[1] is slow.deadlines[0]
+
+
+def test_failed_payment_cancels_winner():
+    fast = FakeDriver("https://www.fast.com", pay_error=RetailerError("card"))
+    slow = FakeDriver("https://www.slow.com", delay=0.2)
+    with race(fast, slow) as retailer_race:
+        with pytest.raises(RetailerError):
+            retailer_race.buy(fast.url + "/p")
+
+    assert fast.cancelled == 1
+    assert slow.cancelled == 1
+
+
+def test_unknown_payment_outcome_keeps_basket():
+    fast = FakeDriver("https://www.fast.com", pay_error=PaymentOutcomeUnknown())
+    slow = FakeDriver("https://www.slow.com", delay=0.2)
+    with race(fast, slow) as retailer_race:
+        with pytest.raises(PaymentOutcomeUnknown):
+            retailer_race.buy(fast.url + "/p")
+
+    assert fast.cancelled == 0
+    assert slow.cancelled == 1
+
+
+def test_all_fail():
+    first = FakeDriver("https://www.first.com", error=RetailerError("sold out"))
+    second = FakeDriver("https://www.second.com", 0.1, RetailerError("no stock"))
+    with race(first, second) as retailer_race:
+        with pytest.raises(RetailerError) as exc_info:
+            retailer_race.reach_payment(first.url + "/p")
+        assert retailer_race._deadline is None
+
+    assert "sold out" in str(exc_info.value)
+    assert "no stock" in str(exc_info.value)
+    assert first.cancelled == 1
+    assert second.cancelled == 1
+
+
+def test_all_fail_on_a_bug():
+    first = FakeDriver("https://www.first.com", error=RetailerError("sold out"))
+    second = FakeDriver("https://www.second.com", 0.1, ValueError("bug"))
+    with race(first, second) as retailer_race:
+        with pytest.raises(ValueError):
+            retailer_race.reach_payment(first.url + "/p")
+
+    assert first.cancelled == 1
+    assert second.cancelled == 1
+
+
+def test_no_retailer():
+    driver = FakeDriver("https://www.first.com")
+    with race(driver) as retailer_race:
+        with pytest.raises(RetailerError):
+            retailer_race.reach_payment("https://www.other.com/p")
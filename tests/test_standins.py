@@ -0,0 +1,75 @@
+# coding=utf-8
+
+import pytest
+import requests
+
+from nvibot.bench import Benchmark
+from nvibot.notifiers import LogNotifier
+from nvibot.nvidia_api import NvidiaApiScrapper, NvidiaApiError
+from nvibot.standins import NvidiaStandIn, LdlcStandIn
+
+FE_SKU = next(iter(NvidiaApiScrapper.sku_name_map))
+GPU = NvidiaApiScrapper.sku_name_map[FE_SKU]
+
+
+@pytest.fixture
+def nvidia():
+    with NvidiaStandIn() as nvidia:
+        yield nvidia
+
+
+@pytest.fixture
+def scrapper(nvidia):
+    scrapper = NvidiaApiScrapper(LogNotifier(), timeout=2)
+    scrapper.api_url = nvidia.api_url
+    yield scrapper
+    scrapper.close()
+
+
+def test_scrap_flip(nvidia, scrapper):
+    events = []
+    scrapper.subscribe(lambda *event: events.append(event))
+    assert scrapper.scrap() == {}
+
+    nvidia.flip(FE_SKU, True, "https://www.ldlc.com/fiche/AR1.html")
+    assert scrapper.scrap() == {GPU: "https://www.ldlc.com/fiche/AR1.html"}
+    assert (
+        "in_stock",
+        GPU,
+        "https://www.ldlc.com/fiche/AR1.html",
+    ) in events
+
+    nvidia.flip(FE_SKU, False)
+    assert scrapper.scrap() == {}
+
+
+def test_scrap_unchanged(nvidia, scrapper):
+    scrapper.scrap()
+    scrapper.scrap()
+    assert scrapper.unchanged_count == 1
+    assert nvidia.request_count == 2
+
+
+def test_scrap_error(nvidia, scrapper):
+    scrapper.api_url = nvidia.url + "/missing"
+    with pytest.raises(NvidiaApiError):
+        scrapper.scrap()
+
+
+def test_ldlc_pages():
+    with LdlcStandIn() as ldlc:
+        url = ldlc.product_url("AR1")
+        assert requests.get(url).status_code == 404
+        ldlc.set_available("AR1", False)
+        assert requests.get(url).status_code == 410
+        ldlc.set_available("AR1")
+        assert "add-to-cart-oneclic" in requests.get(url).text
+
+
+def test_benchmark_detection(nvidia):
+    with LdlcStandIn() as ldlc:
+        samples = Benchmark(nvidia, ldlc, 0.05, FE_SKU).run(3)
+
+    assert len(samples["detect"]) == 3
+    assert all(0 <= latency < 1 for latency in samples["detect"])
+    assert samples["cart"] == samples["order"] == []